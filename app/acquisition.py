@@ -0,0 +1,531 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+from app import metrics, store
+from app.classes import AppStatus, RoastEventId, RoastSession
+from app.journal import find_unfinished
+from app.library import RoastLibrary
+from app.metrics import STAGE_SECONDS, Counter, Gauge
+from app.pipeline import SampleWindow
+from app.pubsub import Broker
+from app.reference import ReferenceCache, from_alog, from_library
+from app.replay import replay
+from app.roaster import Roaster, roaster_settings
+from app.scheduler import Deadline, LoopMonitor, Ticker
+from app.wire import emit_frames
+
+# acquisition: the roasters' devices, tickers and sessions. it runs inside the
+# web server, or with acquisition.separate as its own process
+#
+#   python -m app.acquisition
+#   uvicorn app.main:app --workers 4
+#
+# where it publishes every emit to the web workers over app/pubsub.py. the
+# workers keep no roaster state, they serve the clients and call the commands
+# below, so the device read never shares a loop with the viewers
+logger = logging.getLogger("uvicorn")
+
+COMMANDS = (
+    "subscribe",
+    "unsubscribe",
+    "snapshot",
+    "gas_value",
+    "charge",
+    "first_crack",
+    "drop",
+    "on",
+    "off",
+    "start",
+    "stop",
+    "reset",
+    "show_replay",
+    "stop_replay",
+    "set_reference",
+    "session_info",
+    "series",
+    "status",
+    "scrape",
+)
+
+
+def _points() -> dict[tuple, float]:
+    result = {}
+    for roaster in store.roasters.values():
+        for series_id, points in roaster.points.items():
+            result[(roaster.id, series_id)] = points
+    return result
+
+
+def _ticker(field: str) -> dict[tuple, float]:
+    result = {}
+    for roaster in store.roasters.values():
+        for ticker in (roaster.read_device_ticker, roaster.update_timer_ticker):
+            if ticker is not None:
+                result[(ticker.name,)] = getattr(ticker, field)
+    return result
+
+
+# read at scrape time from the state that already counts them
+Gauge(
+    "roastcraft_session_points",
+    "points per series",
+    ("roaster", "series"),
+    _points,
+)
+Counter("roastcraft_ticks_total", "ticks run", ("ticker",), lambda: _ticker("ticks"))
+Counter(
+    "roastcraft_tick_overruns_total",
+    "ticks that ran past their next deadline",
+    ("ticker",),
+    lambda: _ticker("overruns"),
+)
+Counter(
+    "roastcraft_ticks_skipped_total",
+    "deadlines skipped after an overrun",
+    ("ticker",),
+    lambda: _ticker("skipped"),
+)
+Counter(
+    "roastcraft_tick_errors_total",
+    "ticks that raised",
+    ("ticker",),
+    lambda: _ticker("errors"),
+)
+
+
+def setup():
+    store.references = ReferenceCache(store.settings["reference"]["cache_size"])
+    store.roasters = {}
+    for entry in store.settings["roasters"]:
+        roaster = Roaster(roaster_settings(store.settings, entry))
+        store.roasters[roaster.id] = roaster
+
+
+async def begin():
+    # carry on with roasts that were recording when the server went down
+    for roaster in store.roasters.values():
+        path = find_unfinished(roaster.journal_directory)
+        if path is None:
+            continue
+        await roaster.run(roaster.recover, path, store.clock())
+
+        await roaster.device.connect()
+        start_read_device(roaster)
+        start_update_timer(roaster)
+        roaster.app_status = AppStatus.RECORDING
+
+
+async def end():
+    for roaster in store.roasters.values():
+        roaster.processing.shutdown(wait=True, cancel_futures=True)
+
+
+async def emit_app_status(roaster: Roaster):
+    await store.socketio_server.emit(
+        "app_status", roaster.app_status.name, to=roaster.id
+    )
+
+
+async def emit_mark(roaster: Roaster, event_id: RoastEventId, marked: dict):
+    sio = store.socketio_server
+    if event_id == RoastEventId.C:
+        await sio.emit("time_offset", marked["time_offset"], to=roaster.id)
+    await emit_frames(sio, roaster.id, "roast_events", marked["roast_events"])
+
+
+def last_index(roaster: Roaster) -> int:
+    # the BT point shown when the button was pressed, the last one published,
+    # taken on the loop so a tick queued on the processing thread cannot move
+    # the mark
+    return roaster.shown
+
+
+# commands, the clients' requests by roaster id
+
+
+async def subscribe(roaster_id: str, wire: str, width: int) -> dict:
+    # a client joined with a plot_width(), returns its read_device payload
+    roaster = store.roasters[roaster_id]
+    return await roaster.run(roaster.subscribe, wire, width)
+
+
+async def unsubscribe(roaster_id: str, wire: str, width: int):
+    roaster = store.roasters[roaster_id]
+    await roaster.run(roaster.unsubscribe, wire, width)
+
+
+async def snapshot(roaster_id: str, wire: str, width: int) -> dict:
+    roaster = store.roasters[roaster_id]
+    frames = await roaster.run(roaster.snapshot, [(wire, width)])
+    return frames[(wire, width)]
+
+
+async def gas_value(roaster_id: str, data):
+    roaster = store.roasters[roaster_id]
+    await roaster.run(roaster.gas, data, store.clock())
+
+
+async def charge(roaster_id: str, data: str):
+    roaster = store.roasters[roaster_id]
+    if data == "charge":
+        marked = await roaster.run(roaster.mark, RoastEventId.C, last_index(roaster))
+    else:  # data == "to_left" or "to_right"
+        step = -1 if data == "to_left" else 1
+        marked = await roaster.run(roaster.mark, RoastEventId.C, None, step)
+    await emit_mark(roaster, RoastEventId.C, marked)
+
+
+async def first_crack(roaster_id: str):
+    roaster = store.roasters[roaster_id]
+    marked = await roaster.run(roaster.mark, RoastEventId.FC, last_index(roaster))
+    await emit_mark(roaster, RoastEventId.FC, marked)
+
+
+async def drop(roaster_id: str):
+    roaster = store.roasters[roaster_id]
+    marked = await roaster.run(roaster.mark, RoastEventId.D, last_index(roaster))
+    await emit_mark(roaster, RoastEventId.D, marked)
+
+
+async def on(roaster_id: str):
+    # TODO: implicit reset data
+    roaster = store.roasters[roaster_id]
+
+    # the device takes over from a replay shown to the clients
+    await cancel_replay(roaster)
+
+    await roaster.device.connect()
+    start_read_device(roaster)
+
+    roaster.app_status = AppStatus.ON
+    await emit_app_status(roaster)
+
+
+async def off(roaster_id: str):
+    roaster = store.roasters[roaster_id]
+    await stop_read_device(roaster)
+    await roaster.device.close()
+
+    roaster.app_status = AppStatus.OFF
+    await emit_app_status(roaster)
+
+
+async def start(roaster_id: str):
+    roaster = store.roasters[roaster_id]
+    await roaster.run(roaster.start, store.clock())
+
+    start_update_timer(roaster)
+
+    roaster.app_status = AppStatus.RECORDING
+    await emit_app_status(roaster)
+
+
+async def stop(roaster_id: str):
+    roaster = store.roasters[roaster_id]
+    await stop_read_device(roaster)
+    await roaster.device.close()
+
+    roaster.update_timer_task.cancel()
+
+    await roaster.run(roaster.stop, store.library)
+
+    roaster.app_status = AppStatus.OFF
+    await emit_app_status(roaster)
+
+
+async def reset(roaster_id: str):
+    roaster = store.roasters[roaster_id]
+    await roaster.run(roaster.reset)
+    frames = await roaster.run(roaster.snapshot)
+
+    # a new session is at 0:00
+    sio = store.socketio_server
+    await sio.emit("update_timer", 0.0, to=roaster.id)
+    await emit_frames(sio, roaster.id, "read_device", frames)
+    await emit_app_status(roaster)
+
+
+async def show_replay(roaster_id: str, path: str, speed: float) -> bool:
+    # play a log to the roaster's clients at speed, in the background. False
+    # when the roaster is in use
+    roaster = store.roasters[roaster_id]
+    if roaster.app_status != AppStatus.OFF:
+        return False
+    await cancel_replay(roaster)
+    task = store.loop.create_task(
+        replay(
+            path,
+            roaster.settings,
+            speed,
+            on_tick=broadcaster(roaster),
+            run=roaster.run,
+        )
+    )
+
+    def done(task: asyncio.Task):
+        # played to the end or failed, cancel_replay() ends the others
+        if roaster.replay_task is task:
+            roaster.replay_task = None
+            store.loop.create_task(end_replay(roaster))
+
+    roaster.replay_task = task
+    task.add_done_callback(done)
+    return True
+
+
+async def stop_replay(roaster_id: str):
+    roaster = store.roasters[roaster_id]
+    await cancel_replay(roaster)
+
+
+async def set_reference(roaster_id: str, source: str | None, key=None) -> dict:
+    # follow a past roast: source "library" with a roast id, "alog" with a
+    # path, None to stop. {"error": ...} when it cannot be used
+    roaster = store.roasters[roaster_id]
+    profile = None
+    if source is not None:
+        if source == "alog":
+            cache_key = (source, key, os.path.getmtime(key))
+            load = from_alog
+        else:
+            cache_key = (source, key)
+            load = functools.partial(from_library, store.library)
+        profile = store.references.get(cache_key)
+        if profile is None:
+            # read and resampled off the loop, once per source
+            try:
+                profile = await asyncio.to_thread(load, key, roaster.settings)
+            except ValueError as e:
+                return {"error": str(e)}
+            if profile is None:
+                return {"error": f"no roast {key}"}
+            store.references.put(cache_key, profile)
+
+    await roaster.run(roaster.use_reference, profile)
+    payload = None if profile is None else profile.payload()
+    await store.socketio_server.emit("reference", payload, to=roaster.id)
+    return {"name": None if profile is None else profile.name}
+
+
+async def session_info(roaster_id: str) -> dict:
+    roaster = store.roasters[roaster_id]
+    return await roaster.run(roaster.session_info)
+
+
+async def series(roaster_id: str, key: str, *args) -> dict | None:
+    # a range of a session series, see app/series.py
+    roaster = store.roasters[roaster_id]
+    return await roaster.run(roaster.series, key, *args)
+
+
+async def status() -> dict[str, AppStatus]:
+    return {id: r.app_status for id, r in store.roasters.items()}
+
+
+async def scrape() -> str:
+    return metrics.render()
+
+
+def broadcaster(roaster: Roaster):
+    # show the replay to the roaster's clients like a live roast
+    sio = store.socketio_server
+
+    async def broadcast(session: RoastSession, detected: list[RoastEventId]):
+        shown = await roaster.run(roaster.show, session, detected)
+        if "snapshot" in shown:
+            await emit_frames(sio, roaster.id, "read_device", shown["snapshot"])
+            return
+
+        if RoastEventId.C in detected:
+            await sio.emit("time_offset", shown["time_offset"], to=roaster.id)
+        if len(detected) > 0:
+            await emit_frames(sio, roaster.id, "roast_events", shown["roast_events"])
+        await sio.emit("update_timer", shown["timer"], to=roaster.id)
+        await emit_frames(sio, roaster.id, "read_device_delta", shown["frames"])
+
+    return broadcast
+
+
+async def end_replay(roaster: Roaster):
+    # the clients see the roaster's own session again
+    restored = await roaster.run(roaster.end_replay)
+    if restored is None:
+        return
+    sio = store.socketio_server
+    await sio.emit("update_timer", restored["timer"], to=roaster.id)
+    await emit_frames(sio, roaster.id, "read_device", restored["frames"])
+
+
+async def cancel_replay(roaster: Roaster):
+    task, roaster.replay_task = roaster.replay_task, None
+    if task is not None:
+        task.cancel()
+    await end_replay(roaster)
+
+
+def start_read_device(roaster: Roaster):
+    # the device is read every read_device_interval. the reads are aggregated
+    # into a session sample every process_interval, and the samples are
+    # emitted every publish_interval, on the read that makes them due
+    scheduler = roaster.settings["scheduler"]
+    slack = scheduler["read_device_interval"] / 2
+    roaster.samples = SampleWindow()
+    roaster.process_deadline = Deadline(scheduler["process_interval"], slack)
+    roaster.publish_deadline = Deadline(scheduler["publish_interval"], slack)
+
+    async def tick():
+        await read_device(roaster)
+
+    roaster.read_device_ticker = Ticker(
+        scheduler["read_device_interval"],
+        tick,
+        missed_deadline=scheduler["missed_deadline"],
+        clock=store.clock,
+        name=f"{roaster.id}.read_device",
+    )
+    roaster.read_device_task = store.loop.create_task(roaster.read_device_ticker.run())
+
+
+async def stop_read_device(roaster: Roaster):
+    # the reads not processed yet and the samples not emitted yet go out
+    roaster.read_device_task.cancel()
+    if roaster.samples.count > 0:
+        await process_samples(roaster)
+    await publish(roaster)
+
+
+def start_update_timer(roaster: Roaster):
+    scheduler = roaster.settings["scheduler"]
+
+    async def tick():
+        await update_timer(roaster)
+
+    roaster.update_timer_ticker = Ticker(
+        scheduler["update_timer_interval"],
+        tick,
+        missed_deadline="skip",
+        clock=store.clock,
+        name=f"{roaster.id}.update_timer",
+    )
+    roaster.update_timer_task = store.loop.create_task(
+        roaster.update_timer_ticker.run()
+    )
+
+
+async def read_device(roaster: Roaster):
+    # the device read stays on the loop, the reads wait for the next
+    # processing tick in the roaster's sample window
+    start = time.perf_counter()
+    result = await roaster.device.read()
+    now = store.clock()
+    STAGE_SECONDS.observe(time.perf_counter() - start, (roaster.id, "device_read"))
+    logger.info("%s result: %s", roaster.id, result)
+
+    # a channel that did not answer leaves a gap, not a bogus sample
+    if any(result.get(id) is None for id in roaster.channel_ids):
+        logger.warning("%s: incomplete read, skipped", roaster.id)
+    else:
+        roaster.samples.add(result, now)
+
+    if not roaster.process_deadline.due(now):
+        return
+    if await process_samples(roaster) & roaster.publish_deadline.due(now):
+        await publish(roaster)
+
+
+async def process_samples(roaster: Roaster) -> bool:
+    # the numeric pipeline runs on the roaster's processing thread, on the
+    # mean of the reads since the last sample. False when there was none
+    window, roaster.samples = roaster.samples, SampleWindow()
+    aggregated = window.aggregate()
+    if aggregated is None:
+        logger.warning("%s: no complete read, no sample", roaster.id)
+        return False
+    result, now, spread = aggregated
+
+    recording = roaster.app_status == AppStatus.RECORDING
+    start = time.perf_counter()
+    processed = await roaster.run(roaster.tick, result, now, recording, spread)
+    elapsed = time.perf_counter() - start
+    # what the tick waited for the processing thread on top of its own work
+    STAGE_SECONDS.observe(
+        elapsed - sum(processed["timings"].values()), (roaster.id, "handoff")
+    )
+    for stage, seconds in processed["timings"].items():
+        STAGE_SECONDS.observe(seconds, (roaster.id, stage))
+    STAGE_SECONDS.observe(elapsed, (roaster.id, "tick"))
+    return True
+
+
+async def publish(roaster: Roaster):
+    # the samples taken since the last publish go out in one delta, however
+    # many there are
+    sio = store.socketio_server
+    published = await roaster.run(roaster.publish)
+    STAGE_SECONDS.observe(published["timings"]["serialize"], (roaster.id, "serialize"))
+
+    detected = published["detected"]
+    if RoastEventId.C in detected:
+        await sio.emit("time_offset", published["time_offset"], to=roaster.id)
+    if len(detected) > 0:
+        await emit_frames(sio, roaster.id, "roast_events", published["roast_events"])
+
+    # in process: includes the socket.io packet encoding. separate: the
+    # broker's write to every worker, which never waits on them
+    start = time.perf_counter()
+    await emit_frames(sio, roaster.id, "read_device_delta", published["frames"])
+    STAGE_SECONDS.observe(time.perf_counter() - start, (roaster.id, "emit"))
+
+
+async def update_timer(roaster: Roaster):
+    timer = await roaster.run(roaster.timer, store.clock())
+    await store.socketio_server.emit("update_timer", timer, to=roaster.id)
+
+
+async def serve():
+    store.loop = asyncio.get_running_loop()
+    broker = Broker(
+        store.settings["acquisition"]["socket"], sys.modules[__name__], COMMANDS
+    )
+    store.socketio_server = broker
+    await broker.start()
+    await begin()
+
+    processing = store.settings["processing"]
+    monitor = LoopMonitor(
+        processing["loop_monitor_interval"],
+        processing["max_handler_latency"],
+        clock=store.clock,
+        name="acquisition",
+    )
+    monitor_task = store.loop.create_task(monitor.run())
+
+    stopping = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        store.loop.add_signal_handler(signum, stopping.set)
+    await stopping.wait()
+
+    monitor_task.cancel()
+    await broker.close()
+    await end()
+    store.library.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    with open("app/settings.json", "rb") as f:
+        store.settings = json.load(f)
+    store.clock = time.monotonic
+    store.library = RoastLibrary(store.settings["library"]["path"])
+    setup()
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import ast
+import codecs
+import logging
+import os
+import re
+import struct
+import zipfile
+
+import numpy
+from numpy.lib import format as npy
+
+logger = logging.getLogger("uvicorn")
+
+# artisan .alog files are one python dict literal. only these keys are read,
+# scanned out of the text instead of evaluating the whole dict
+NUMBERS = ("timex", "temp1", "temp2", "timeindex", "roastepoch")
+NUMBERS += ("specialevents", "specialeventstype", "specialeventsvalue")
+NESTED = ("extratemp1", "extratemp2")  # one list per extra device
+STRINGS = ("title", "beans")
+STRING_LISTS = ("extraname1", "extraname2")
+
+# timeindex slots, 0 means unset except for CHARGE which uses -1
+TIMEINDEX = ("CHARGE", "DRY", "FCs", "FCe", "SCs", "SCe", "DROP", "COOL")
+
+_string = re.compile(r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*\"""")
+_local_header = struct.Struct("<4s22xHH")
+
+
+def _literal(text: str, key: str) -> str | None:
+    # source text of the value of a top level key, None if the key is missing
+    start = text.find(f"'{key}': ")
+    if start < 0:
+        return None
+    start += len(key) + 4
+
+    if text[start] in "'\"":
+        return _string.match(text, start).group()
+    if text[start] != "[":
+        end = start
+        while text[end] not in ",}":
+            end += 1
+        return text[start:end]
+
+    # number lists carry no strings, brackets can be counted
+    depth = 0
+    for end in range(start, len(text)):
+        if text[end] == "[":
+            depth += 1
+        elif text[end] == "]":
+            depth -= 1
+            if depth == 0:
+                return text[start : end + 1]
+    raise ValueError(f"unterminated list at {key}")
+
+
+def _numbers(literal: str | None) -> numpy.ndarray:
+    if (literal is None) | (literal == "[]"):
+        return numpy.zeros(0)
+    return numpy.array(literal.strip("[]").split(","), dtype=float)
+
+
+def _nested(literal: str | None) -> list[numpy.ndarray]:
+    if literal is None:
+        return []
+    return [_numbers(row) for row in re.findall(r"\[[^\[\]]*\]", literal[1:-1])]
+
+
+def _columns(raw: dict) -> dict[str, numpy.ndarray]:
+    # raw values by key -> the flat arrays stored in the cache
+    n = len(raw["timex"])
+    names, rows = [], []
+    for k in (1, 2):
+        for name, row in zip(raw[f"extraname{k}"], raw[f"extratemp{k}"]):
+            names.append(name)
+            rows.append(numpy.resize(numpy.asarray(row, dtype=float), n))
+
+    columns = {key: numpy.asarray(raw[key], dtype=float) for key in NUMBERS}
+    columns["timeindex"] = columns["timeindex"].astype(numpy.int64)
+    columns["specialevents"] = columns["specialevents"].astype(numpy.int64)
+    columns["specialeventstype"] = columns["specialeventstype"].astype(numpy.int64)
+    columns["extratemp"] = numpy.array(rows).reshape(len(rows), n)
+    columns["extraname"] = numpy.array(names, dtype=str)
+    columns["meta"] = numpy.array([raw["title"], raw["beans"]], dtype=str)
+    return columns
+
+
+def parse_alog(path: str) -> dict[str, numpy.ndarray]:
+    with codecs.open(path, "rb", encoding="utf-8") as file:
+        text = file.read()
+
+    try:
+        raw = {key: _numbers(_literal(text, key)) for key in NUMBERS}
+        raw.update({key: _nested(_literal(text, key)) for key in NESTED})
+        for key in STRINGS + STRING_LISTS:
+            literal = _literal(text, key)
+            raw[key] = ast.literal_eval(literal) if literal is not None else ""
+        return _columns(raw)
+    except (ValueError, SyntaxError, AttributeError, IndexError) as e:
+        # layout the scanner does not know, evaluate the whole file
+        logger.warning("alog scan of %s failed (%s), evaluating it", path, e)
+        result = ast.literal_eval(text)
+        raw = {key: result.get(key, []) for key in NUMBERS + NESTED + STRING_LISTS}
+        raw.update({key: result.get(key, "") for key in STRINGS})
+        return _columns(raw)
+
+
+def _memmap_npz(path: str) -> dict[str, numpy.ndarray]:
+    # members of an uncompressed .npz are plain .npy files at known offsets
+    columns = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as file:
+        for info in archive.infolist():
+            name = info.filename.removesuffix(".npy")
+            if info.compress_type != zipfile.ZIP_STORED:
+                columns[name] = numpy.load(archive.open(info))
+                continue
+            file.seek(info.header_offset)
+            _, name_length, extra_length = _local_header.unpack(
+                file.read(_local_header.size)
+            )
+            file.seek(name_length + extra_length, os.SEEK_CUR)
+            if npy.read_magic(file) == (1, 0):
+                shape, fortran, dtype = npy.read_array_header_1_0(file)
+            else:
+                shape, fortran, dtype = npy.read_array_header_2_0(file)
+            if (0 in shape) | (len(shape) == 0):
+                columns[name] = numpy.zeros(shape, dtype=dtype)
+                continue
+            columns[name] = numpy.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=file.tell(),
+                shape=shape,
+                order="F" if fortran else "C",
+            )
+    return columns
+
+
+class Alog:
+    # the parts of an artisan log that roastcraft uses, as arrays
+    def __init__(self, columns: dict[str, numpy.ndarray]):
+        self.time: numpy.ndarray = columns["timex"]
+        self.bt: numpy.ndarray = columns["temp2"]
+        self.et: numpy.ndarray = columns["temp1"]
+        # extra device channels, all extratemp1 rows then all extratemp2 rows
+        self.extratemp: numpy.ndarray = columns["extratemp"]
+        self.extraname: list[str] = columns["extraname"].tolist()
+        self.timeindex: numpy.ndarray = columns["timeindex"]
+        self.specialevents: numpy.ndarray = columns["specialevents"]
+        self.specialeventstype: numpy.ndarray = columns["specialeventstype"]
+        self.specialeventsvalue: numpy.ndarray = columns["specialeventsvalue"]
+        self.title: str = str(columns["meta"][0])
+        self.beans: str = str(columns["meta"][1])
+        epoch = columns["roastepoch"]
+        self.roastepoch: float = float(epoch[0]) if len(epoch) > 0 else 0.0
+
+    def __len__(self):
+        return len(self.time)
+
+    def extra(self, name: str) -> numpy.ndarray:
+        return self.extratemp[self.extraname.index(name)]
+
+    def events(self) -> dict[str, int]:
+        # timeindex as name -> sample index, unset slots left out
+        return {
+            name: int(index)
+            for k, (name, index) in enumerate(zip(TIMEINDEX, self.timeindex))
+            if (index > 0) | ((k == 0) & (index >= 0))
+        }
+
+
+def load_alog(path: str, cache: bool = True) -> Alog:
+    # parse once, then memory-map the .npz cache written next to the source
+    cache_path = path + ".npz"
+    if cache:
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(path):
+                return Alog(_memmap_npz(cache_path))
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning("alog cache %s unreadable (%s)", cache_path, e)
+
+    columns = parse_alog(path)
+    if cache:
+        try:
+            # write aside and rename, a reader never sees half a cache
+            with open(cache_path + ".tmp", "wb") as file:
+                numpy.savez(file, **columns)
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError as e:
+            logger.warning("alog cache %s not written (%s)", cache_path, e)
+    return Alog(columns)
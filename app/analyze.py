@@ -0,0 +1,245 @@
+# season statistics: every .alog under a directory through the processing
+# pipeline, one row per roast in a columnar .npz summary
+#
+# python -m app.analyze logs/2024 [--output logs/2024/summary.npz] [--workers 8]
+#
+# a file whose mtime is unchanged since the last run is not read again, one
+# whose mtime changed is hashed and only analyzed when its content changed
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy
+
+from app.alog import Alog, load_alog
+from app.calculate import RoastEventDetector, calculate_phases
+from app.classes import RoastEventId, RoastSession
+from app.library import roast_summary
+from app.pipeline import new_session
+from app.ror import batch_ror
+
+logger = logging.getLogger("uvicorn")
+
+# summary columns, one array each
+TEXT = ("path", "hash", "error", "title", "beans")
+EVENTS = {
+    "charge": RoastEventId.C,
+    "tp": RoastEventId.TP,
+    "dry_end": RoastEventId.DE,
+    "first_crack": RoastEventId.FC,
+    "drop": RoastEventId.D,
+}
+INTEGERS = ("samples",) + tuple(EVENTS)  # event columns are -1 when not found
+FLOATS = ("mtime", "roastepoch", "time_offset")
+FLOATS += ("total_time", "dtr", "charge_temp", "drop_temp")  # roast_summary()
+FLOATS += ("dry_time", "mai_time", "dev_time", "dry_ror", "mai_ror", "dev_ror")
+FLOATS += tuple(f"{p}_{s}" for p in ("dry", "mai", "dev") for s in ("percent", "rise"))
+
+
+def analyze(log: Alog, settings: dict) -> RoastSession:
+    # the session a replay of the log would end with, each channel's ror and
+    # filters computed in one pass instead of sample by sample
+    session = new_session(settings)
+    session.start_time = datetime.fromtimestamp(log.roastepoch)
+    t = numpy.asarray(log.time, dtype=float)
+    timestamp = log.roastepoch + t
+
+    # the channels ArtisanLog reads
+    values = {"BT": log.bt, "ET": log.et}
+    if len(log.extratemp) > 0:
+        values["INLET"] = log.extratemp[0]
+    for ch, c in zip(settings["channels"], session.channels):
+        if ch["id"] not in values:
+            continue
+        value = numpy.asarray(values[ch["id"]], dtype=float)
+        ror = batch_ror(t, value, ch["ror"]["estimator"], ch["ror"]["window"])
+        c.extend(timestamp, t, value, ror)
+        if len(value) > 0:
+            c.current_data = float(value[-1])
+            c.current_ror = float(ror[-1])
+
+    bt = session.bt_channel
+    if len(bt.data) == 0:
+        return session
+    detector = RoastEventDetector(**settings["event_detection"])
+    for value, ror in zip(bt.data.value.tolist(), bt.ror.value.tolist()):
+        detector.push(value, ror, session.roast_events)
+    # first crack is the operator's, marked in the log
+    events = log.events()
+    if "FCs" in events:
+        session.roast_events[RoastEventId.FC] = events["FCs"]
+
+    if RoastEventId.C in session.roast_events:
+        session.time_offset = float(t[session.roast_events[RoastEventId.C]])
+    session.timer = float(t[-1]) - session.time_offset
+    session.phases = calculate_phases(
+        session.timer, bt.current_data, session.roast_events, session
+    )
+    return session
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def empty_row(path: str, mtime: float, digest: str) -> dict:
+    row = {name: "" for name in TEXT}
+    row.update({name: -1 for name in INTEGERS})
+    row.update({name: float("nan") for name in FLOATS})
+    row.update({"path": path, "mtime": mtime, "hash": digest, "samples": 0})
+    return row
+
+
+def analyze_file(
+    directory: str, path: str, settings: dict, previous_hash: str | None = None
+) -> dict | None:
+    # summary row of one log, runs in a worker process. None when the content
+    # hashes to previous_hash, the earlier row still holds
+    full = os.path.join(directory, path)
+    mtime = os.path.getmtime(full)
+    digest = file_hash(full)
+    if digest == previous_hash:
+        return None
+
+    row = empty_row(path, mtime, digest)
+    try:
+        log = load_alog(full, cache=False)
+        session = analyze(log, settings)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        # kept with its error, an unchanged broken file is not read again
+        row["error"] = f"{type(e).__name__}: {e}"
+        return row
+
+    row.update(
+        {
+            "title": log.title,
+            "beans": log.beans,
+            "roastepoch": log.roastepoch,
+            "samples": len(session.bt_channel.data),
+            "time_offset": session.time_offset,
+        }
+    )
+    for name, event_id in EVENTS.items():
+        row[name] = session.roast_events.get(event_id, -1)
+    for name, value in roast_summary(session).items():
+        row[name] = float("nan") if value is None else value
+    for phase in ("dry", "mai", "dev"):
+        row[f"{phase}_percent"] = session.phases[phase].percent
+        row[f"{phase}_rise"] = session.phases[phase].temp_rise
+    return row
+
+
+def read_summary(path: str, fingerprint: str) -> dict[str, dict]:
+    # rows of an earlier run by log path, none if it ran with other settings
+    try:
+        with numpy.load(path, allow_pickle=False) as columns:
+            if str(columns["settings"]) != fingerprint:
+                return {}
+            names = TEXT + INTEGERS + FLOATS
+            data = {name: columns[name].tolist() for name in names}
+    except (OSError, KeyError, ValueError):
+        return {}
+    return {
+        p: {name: data[name][k] for name in names} for k, p in enumerate(data["path"])
+    }
+
+
+def write_summary(path: str, rows: list[dict], fingerprint: str):
+    columns = {"settings": numpy.array(fingerprint)}
+    for name in TEXT:
+        columns[name] = numpy.array([row[name] for row in rows], dtype=str)
+    for name in INTEGERS:
+        columns[name] = numpy.array([row[name] for row in rows], dtype=numpy.int64)
+    for name in FLOATS:
+        columns[name] = numpy.array([row[name] for row in rows], dtype=float)
+    # write aside and rename, a reader never sees half a summary
+    with open(path + ".tmp", "wb") as file:
+        numpy.savez(file, **columns)
+    os.replace(path + ".tmp", path)
+
+
+def alog_paths(directory: str) -> list[str]:
+    # every .alog below directory, relative to it
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(".alog"):
+                paths.append(os.path.relpath(os.path.join(root, name), directory))
+    return paths
+
+
+def _quiet():
+    # worker processes, the per-roast warnings (no CHARGE...) are in the rows
+    logger.setLevel(logging.ERROR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="summarize a directory of .alog")
+    parser.add_argument("directory")
+    parser.add_argument("--output", help="default DIRECTORY/summary.npz")
+    parser.add_argument("--settings", default="app/settings.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    _quiet()
+
+    with open(args.settings, "rb") as f:
+        settings = json.load(f)
+    output = args.output or os.path.join(args.directory, "summary.npz")
+    # rows depend on these settings, a change analyzes everything again
+    fingerprint = json.dumps(
+        [settings["channels"], settings["event_detection"]], sort_keys=True
+    )
+
+    start = time.perf_counter()
+    previous = read_summary(output, fingerprint)
+    rows = {}
+    pending = {}
+    unchanged = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_quiet) as pool:
+        for path in alog_paths(args.directory):
+            row = previous.get(path)
+            mtime = os.path.getmtime(os.path.join(args.directory, path))
+            if (row is not None) and (row["mtime"] == mtime):
+                rows[path] = row
+                continue
+            digest = None if row is None else row["hash"]
+            future = pool.submit(analyze_file, args.directory, path, settings, digest)
+            pending[future] = path
+
+        for future in as_completed(pending):
+            path = pending[future]
+            row = future.result()
+            if row is None:
+                # touched, not changed
+                unchanged += 1
+                row = previous[path]
+                row["mtime"] = os.path.getmtime(os.path.join(args.directory, path))
+            rows[path] = row
+
+    rows = [rows[path] for path in sorted(rows)]
+    write_summary(output, rows, fingerprint)
+    print(
+        json.dumps(
+            {
+                "output": output,
+                "files": len(rows),
+                "analyzed": len(pending) - unchanged,
+                "failed": sum(row["error"] != "" for row in rows),
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
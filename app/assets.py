@@ -0,0 +1,230 @@
+# static files, precompressed and cached for good
+#
+# python -m app.assets     compress every asset ahead of the first request
+#
+# a page links its assets by versioned name, /static/lib/d3.7.9.0.min.js as
+# /static/lib/d3.7.9.0.min.<hash>.js, hash of the content. that url never
+# changes content, browsers keep it for a year without asking again. the
+# plain name is still served, revalidated through its ETag
+#
+# text assets are sent brotli or gzip compressed when the client accepts it,
+# from .br and .gz files written next to the source once, aside and renamed
+# like the alog caches. a missing or outdated one is written in the
+# background, the request does not wait for it and gets the file as it is,
+# revalidated, never kept for good in a larger encoding than it will have
+import asyncio
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import stat
+import sys
+
+import anyio
+import brotli
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+logger = logging.getLogger("uvicorn")
+
+COMPRESSIBLE = (".js", ".mjs", ".css", ".html", ".json", ".svg", ".map", ".txt")
+MIN_SIZE = 1024  # smaller files are not worth a second request's header
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# suffix of a compressed copy by content-encoding, preferred first
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+_versioned = re.compile(r"^(.*)\.([0-9a-f]{10})(\.[^./]+)$")
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    # the smallest output, it is paid for once per file
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compressible(path: str, stat_result: os.stat_result) -> bool:
+    return path.endswith(COMPRESSIBLE) & (stat_result.st_size >= MIN_SIZE)
+
+
+def negotiate(accept_encoding: str) -> list[str]:
+    # ENCODINGS the client takes, best first. q=0 refuses, * covers the
+    # encodings it does not name
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    wildcard = weights.get("*", 0.0)
+    accepted = [e for e in ENCODINGS if weights.get(e, wildcard) > 0]
+    return sorted(accepted, key=lambda e: -weights.get(e, wildcard))
+
+
+def write_compressed(path: str, encoding: str) -> str | None:
+    # path of the compressed copy, None when it does not come out smaller
+    target = path + ENCODINGS[encoding]
+    with open(path, "rb") as f:
+        data = f.read()
+    compressed = compress(data, encoding)
+    if len(compressed) >= len(data):
+        return None
+    with open(target + ".tmp", "wb") as f:
+        f.write(compressed)
+    os.replace(target + ".tmp", target)
+    return target
+
+
+class Assets(StaticFiles):
+    def __init__(self, directory: str):
+        super().__init__(directory=directory)
+        # content hash by path, with the (mtime, size) it was taken at
+        self.digests: dict[str, tuple[tuple[int, int], str]] = {}
+        self.compressing: set[tuple[str, str]] = set()
+        # files that do not get smaller, by (path, encoding), at their mtime
+        self.incompressible: dict[tuple[str, str], int] = {}
+
+    def digest(self, full_path: str, stat_result: os.stat_result) -> str:
+        key = (stat_result.st_mtime_ns, stat_result.st_size)
+        known = self.digests.get(full_path)
+        if (known is not None) and (known[0] == key):
+            return known[1]
+        with open(full_path, "rb") as f:
+            digest = hashlib.blake2b(f.read(), digest_size=5).hexdigest()
+        self.digests[full_path] = (key, digest)
+        return digest
+
+    def versioned(self, path: str) -> str:
+        # template global: the name to link path by, unchanged if missing
+        full_path, stat_result = self.lookup_path(path.lstrip("/"))
+        if (stat_result is None) or (not stat.S_ISREG(stat_result.st_mode)):
+            return path
+        stem, extension = os.path.splitext(path)
+        return f"{stem}.{self.digest(full_path, stat_result)}{extension}"
+
+    def compressed(
+        self, full_path: str, stat_result: os.stat_result, encoding: str
+    ) -> tuple[str, os.stat_result] | None:
+        # an up to date compressed copy, or None and one is on its way
+        target = full_path + ENCODINGS[encoding]
+        try:
+            target_stat = os.stat(target)
+            if target_stat.st_mtime_ns >= stat_result.st_mtime_ns:
+                return target, target_stat
+        except FileNotFoundError:
+            pass
+
+        key = (full_path, encoding)
+        mtime = stat_result.st_mtime_ns
+        if (key in self.compressing) | (self.incompressible.get(key) == mtime):
+            return None
+        self.compressing.add(key)
+
+        def done(future: asyncio.Future):
+            self.compressing.discard(key)
+            if future.exception() is not None:
+                logger.warning("%s not compressed (%s)", target, future.exception())
+            elif future.result() is None:
+                self.incompressible[key] = mtime
+
+        loop = asyncio.get_running_loop()
+        task = loop.run_in_executor(None, write_compressed, full_path, encoding)
+        task.add_done_callback(done)
+        return None
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        # the versioned name of the current content is cached for good
+        immutable = False
+        match = _versioned.match(path)
+        if match is not None:
+            plain = match.group(1) + match.group(3)
+            full_path, stat_result = await anyio.to_thread.run_sync(
+                self.lookup_path, plain
+            )
+            if (stat_result is not None) and stat.S_ISREG(stat_result.st_mode):
+                path = plain
+                digest = self.digest(full_path, stat_result)
+                immutable = digest == match.group(2)
+
+        response = await super().get_response(path, scope)
+        # file_response sets no-cache while a compressed copy is on its way
+        response.headers.setdefault(
+            "cache-control", IMMUTABLE if immutable else "no-cache"
+        )
+        return response
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        headers = {}
+        served, served_stat = full_path, stat_result
+        if compressible(full_path, stat_result):
+            headers["vary"] = "Accept-Encoding"
+            accepted = negotiate(request_headers.get("accept-encoding", ""))
+            for encoding in accepted:
+                found = self.compressed(full_path, stat_result, encoding)
+                if found is not None:
+                    served, served_stat = found
+                    headers["content-encoding"] = encoding
+                    break
+            if any((full_path, e) in self.compressing for e in accepted):
+                # a better encoding is being written, ask again next time
+                headers["cache-control"] = "no-cache"
+
+        # the ETag is of the file sent, each encoding has its own
+        response = FileResponse(
+            served,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=served_stat,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def build(directory: str) -> list[tuple[str, int, dict[str, int]]]:
+    # (path, size, compressed size by encoding) of every compressible file
+    built = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if not compressible(path, os.stat(path)):
+                continue
+            sizes = {}
+            for encoding in ENCODINGS:
+                target = write_compressed(path, encoding)
+                if target is not None:
+                    sizes[encoding] = os.path.getsize(target)
+            built.append((path, os.path.getsize(path), sizes))
+    return built
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else "app/static"
+    for path, size, sizes in build(directory):
+        compressed = "  ".join(f"{e} {s}" for e, s in sizes.items())
+        print(f"{path}  {size}  {compressed}")
+
+
+if __name__ == "__main__":
+    main()
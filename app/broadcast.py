@@ -0,0 +1,148 @@
+from fastapi.encoders import jsonable_encoder
+
+from app.classes import Channel, DerivedSeries, RoastSession
+
+# series that only grow, a delta carries the points appended since the last emit
+APPENDED = ("data", "ror")
+# series rewritten in place, a delta carries the tail that changed
+REWRITTEN = ("ror_filtered", "ror_smoothed")
+
+
+class SessionCursor:
+    def __init__(self):
+        self.seq: int = 0
+        self.sent: dict[str, int] = {}  # series key -> points already sent
+
+
+def points(series, start: int = 0) -> list[dict]:
+    return [
+        {"timestamp": timestamp, "time": time, "value": value}
+        for timestamp, time, value in zip(
+            series.timestamp[start:].tolist(),
+            series.time[start:].tolist(),
+            series.value[start:].tolist(),
+        )
+    ]
+
+
+def _appended(cursor: SessionCursor, key: str, series) -> int:
+    start = min(cursor.sent.get(key, 0), len(series))
+    cursor.sent[key] = len(series)
+    return start
+
+
+def _rewritten(cursor: SessionCursor, key: str, series: DerivedSeries) -> int:
+    changed = series.take_changed() - series.start
+    start = max(0, min(changed, cursor.sent.get(key, 0), len(series)))
+    cursor.sent[key] = len(series)
+    return start
+
+
+def session_series(session: RoastSession) -> list[tuple[str, object]]:
+    # (key, series) of everything a delta carries, in wire order
+    series = []
+    for c in session.channels:
+        for name in APPENDED + REWRITTEN:
+            series.append((f"{c.id}.{name}", getattr(c, name)))
+    series.append(("GAS.data", session.gas_channel.data))
+    return series
+
+
+def delta_starts(session: RoastSession, cursor: SessionCursor) -> dict[str, int]:
+    # moves the cursor on by one delta, series key -> first index it carries.
+    # the json and binary encodings of a delta share the same starts
+    cursor.seq += 1
+    starts = {}
+    for key, series in session_series(session):
+        if isinstance(series, DerivedSeries):
+            starts[key] = _rewritten(cursor, key, series)
+        else:
+            starts[key] = _appended(cursor, key, series)
+    return starts
+
+
+def view_series(view, key: str, series):
+    # the series itself, or its downsampled view (app.downsample.SessionView)
+    return series if view is None else view.series[key]
+
+
+def view_events(view, session: RoastSession) -> dict:
+    if view is None:
+        return jsonable_encoder(session.roast_events)
+    return view.roast_events(session.roast_events)
+
+
+def _channel(c: Channel, view=None) -> dict:
+    channel = {
+        "id": c.id,
+        "color": c.color,
+        "current_data": c.current_data,
+        "current_ror": c.current_ror,
+        "current_min": c.current_min,
+        "current_max": c.current_max,
+    }
+    for name in APPENDED + REWRITTEN:
+        channel[name] = points(view_series(view, f"{c.id}.{name}", getattr(c, name)))
+    return channel
+
+
+def session_snapshot(session: RoastSession, cursor: SessionCursor, view=None) -> dict:
+    gas = session.gas_channel
+
+    return {
+        "seq": cursor.seq,
+        "start_time": jsonable_encoder(session.start_time),
+        "time_offset": session.time_offset,
+        "timer": session.timer,
+        "channels": [_channel(c, view) for c in session.channels],
+        "gas_channel": {
+            "id": gas.id,
+            "current_data": gas.current_data,
+            "data": points(gas.data),
+        },
+        "roast_events": view_events(view, session),
+        "phases": jsonable_encoder(session.phases),
+        "deviation": session.deviation,
+    }
+
+
+def json_delta(
+    session: RoastSession, seq: int, starts: dict[str, int], view=None
+) -> dict:
+    def patch(key: str, series) -> dict:
+        series = view_series(view, key, series)
+        return {"from": starts[key], "points": points(series, starts[key])}
+
+    channels = []
+    for c in session.channels:
+        channel = {
+            "id": c.id,
+            "current_data": c.current_data,
+            "current_ror": c.current_ror,
+            "current_min": c.current_min,
+            "current_max": c.current_max,
+        }
+        for name in APPENDED + REWRITTEN:
+            channel[name] = patch(f"{c.id}.{name}", getattr(c, name))
+        channels.append(channel)
+
+    gas = session.gas_channel
+
+    return {
+        "seq": seq,
+        "time_offset": session.time_offset,
+        "timer": session.timer,
+        "channels": channels,
+        "gas_channel": {
+            "current_data": gas.current_data,
+            "data": patch("GAS.data", gas.data),
+        },
+        "roast_events": view_events(view, session),
+        "phases": jsonable_encoder(session.phases),
+        "deviation": session.deviation,
+    }
+
+
+def session_delta(session: RoastSession, cursor: SessionCursor) -> dict:
+    starts = delta_starts(session, cursor)
+    return json_delta(session, cursor.seq, starts)
@@ -1,19 +1,14 @@
 import logging
+from collections import deque
 import numpy
 
-from fastapi.encoders import jsonable_encoder
-from app import store
-from app.classes import Phase, RoastSession, RoastEventId, Point
+from app.classes import Phase, RoastEventId, RoastSession, Point
 
 logger = logging.getLogger("uvicorn")
 
 
 # https://github.com/erykml/medium_articles/blob/master/Machine%20Learning/outlier_detection_hampel_filter.ipynb
-def hampel_filter_forloop_point(input_series: list[Point], window_size, n_sigmas=3):
-
-    input_series_value = []
-    for p in input_series:
-        input_series_value.append(p.value)
+def hampel_filter_forloop(input_series: numpy.ndarray, window_size, n_sigmas=3):
 
     n = len(input_series)
     filtered = input_series.copy()
@@ -23,147 +18,107 @@ def hampel_filter_forloop_point(input_series: list[Point], window_size, n_sigmas
 
     # possibly use np.nanmedian
     for i in range((window_size), (n - window_size)):
-        x0 = numpy.median(input_series_value[(i - window_size) : (i + window_size)])
+        x0 = numpy.median(input_series[(i - window_size) : (i + window_size)])
         s0 = k * numpy.median(
-            numpy.abs(input_series_value[(i - window_size) : (i + window_size)] - x0)
+            numpy.abs(input_series[(i - window_size) : (i + window_size)] - x0)
         )
-        if numpy.abs(input_series_value[i] - x0) > n_sigmas * s0:
-            filtered[i] = Point(input_series[i].timestamp, input_series[i].time, x0)
-            outliers.append(input_series[i])
+        if numpy.abs(input_series[i] - x0) > n_sigmas * s0:
+            filtered[i] = x0
+            outliers.append(i)
 
     return filtered, outliers
 
 
-async def auto_detect_charge():
-    session: RoastSession = store.session
-    ror: list[Point] = session.bt_channel.ror
-    if (RoastEventId.C not in session.roast_events) & (len(ror) > 5):
-        # window array: [ 0][ 1][ 2][ 3][ 4]
-        #    ror array: [-5][-4][-3][-2][-1]
-        #                       ^^^^
-        #                       CHARGE
-
-        window = list(map(lambda p: p.value, ror[-5:]))
-        dpre = (window[0] + window[1]) / 2.0
-        dpost = (window[3] + window[4]) / 2.0
-        if (
-            (window[0] > 0.0)
-            & (window[1] > 0.0)
-            & (window[3] < 0.0)
-            & (window[4] < 0.0)
-            & (abs(dpost) > abs(dpre) * 2)
-        ):
-            charge_index = len(ror) - 3
-
-            logger.info("auto detected chargeat ror index: %s", charge_index)
-
-            session.roast_events[RoastEventId.C] = charge_index
-
-            # re calculate time
-            session.start_time = session.bt_channel.data[charge_index].timestamp
-            for channel in session.channels:
-                for point in channel.data:
-                    point.time = (point.timestamp - session.start_time).total_seconds()
-                for point in channel.ror:
-                    point.time = (point.timestamp - session.start_time).total_seconds()
-
-            for point in session.gas_channel.data:
-                point.time = (point.timestamp - session.start_time).total_seconds()
-
-            await store.socketio_server.emit(
-                "roast_events", jsonable_encoder(session.roast_events)
-            )
+class RoastEventDetector:
+    # finds CHARGE, TURNING POINT, DRY END and DROP while the BT samples arrive,
+    # every sample is looked at once. FIRST CRACK is marked by the operator.
+    def __init__(
+        self,
+        dry_end: float = 150,
+        turning_point_drop: float = 50,
+        slope_ratio: float = 2,
+    ):
+        self.dry_end: float = dry_end
+        self.turning_point_drop: float = turning_point_drop
+        self.slope_ratio: float = slope_ratio
 
+        self.count: int = 0  # samples seen
+        self.bt_low: float = 1000  # lowest BT so far
+        self.bt_high: float = 0  # highest BT so far
+        self.bt_window: deque[float] = deque(maxlen=2)
+        self.ror_window: deque[float] = deque(maxlen=5)
 
-async def auto_detect_drop():
-    session: RoastSession = store.session
-    ror: list[Point] = session.bt_channel.ror
-    if (
-        (RoastEventId.TP in session.roast_events)
-        & (RoastEventId.D not in session.roast_events)
-        & (len(ror) > 5)
-    ):
+    def _ror_reversed(self) -> bool:
         # window array: [ 0][ 1][ 2][ 3][ 4]
         #    ror array: [-5][-4][-3][-2][-1]
         #                       ^^^^
-        #                       DROP
-
-        window = list(map(lambda p: p.value, ror[-5:]))
+        #                       CHARGE / DROP
+        window = self.ror_window
         dpre = (window[0] + window[1]) / 2.0
         dpost = (window[3] + window[4]) / 2.0
-        if (
+        return (
             (window[0] > 0.0)
             & (window[1] > 0.0)
             & (window[3] < 0.0)
             & (window[4] < 0.0)
-            & (abs(dpost) > abs(dpre) * 2)
-        ):
-            drop_index = len(ror) - 3
-
-            logger.info("auto detected drop at ror index: %s", drop_index)
-
-            session.roast_events[RoastEventId.D] = drop_index
-
-            await store.socketio_server.emit(
-                "roast_events", jsonable_encoder(session.roast_events)
-            )
-
-
-async def auto_detect_dry_end():
-    session: RoastSession = store.session
-
-    if (RoastEventId.TP in session.roast_events) & (
-        RoastEventId.DE not in session.roast_events
-    ):
-        bt: list[Point] = session.bt_channel.data
-
-        dry_end = 150
-
-        if (bt[-1].value > dry_end) & (bt[-2].value > dry_end):
-
-            dry_end_index = len(bt) - 2
-
-            session.roast_events[RoastEventId.DE] = dry_end_index
-
-            await store.socketio_server.emit(
-                "roast_events", jsonable_encoder(session.roast_events)
-            )
-
-
-async def auto_detect_turning_point():
+            & (abs(dpost) > abs(dpre) * self.slope_ratio)
+        )
 
-    session: RoastSession = store.session
+    def push(self, bt: float, ror: float, roast_events: dict) -> list[RoastEventId]:
+        # consume the newest BT sample and its ror, returns the events found
+        self.count += 1
+        self.bt_low = min(bt, self.bt_low)
+        self.bt_high = max(bt, self.bt_high)
+        self.bt_window.append(bt)
+        self.ror_window.append(ror)
 
-    if (RoastEventId.C in session.roast_events) & (
-        RoastEventId.TP not in session.roast_events
-    ):
+        detected: list[RoastEventId] = []
 
-        bt: list[Point] = session.bt_channel.data
+        if (RoastEventId.C not in roast_events) & (self.count > 5):
+            if self._ror_reversed():
+                roast_events[RoastEventId.C] = self.count - 3
+                detected.append(RoastEventId.C)
+                logger.info("auto detected charge at ror index: %s", self.count - 3)
 
-        tp = 1000
-        high_temp = 0
-        target_index = 0
-        tp_found = False
-        temp_drop = 0
+        if (
+            (RoastEventId.C in roast_events)
+            & (RoastEventId.TP not in roast_events)
+            & (self.count > 1)
+        ):
+            # BT climbs again after dropping far enough from its high
+            if (
+                (self.bt_window[0] > self.bt_low)
+                & (self.bt_window[1] > self.bt_low)
+                & (self.bt_high - self.bt_low > self.turning_point_drop)
+            ):
+                roast_events[RoastEventId.TP] = self.count - 3
+                detected.append(RoastEventId.TP)
 
-        for p in bt:
-            tp = min(p.value, tp)
-            high_temp = max(p.value, high_temp)
+        if (
+            (RoastEventId.TP in roast_events)
+            & (RoastEventId.DE not in roast_events)
+            & (self.count > 1)
+        ):
+            if (self.bt_window[0] > self.dry_end) & (self.bt_window[1] > self.dry_end):
+                roast_events[RoastEventId.DE] = self.count - 2
+                detected.append(RoastEventId.DE)
 
-            temp_drop = high_temp - tp
-            if (bt[-1].value > tp) & (bt[-2].value > tp) & (temp_drop > 50):
-                target_index = len(bt) - 3
-                tp_found = True
-                break
+        if (
+            (RoastEventId.TP in roast_events)
+            & (RoastEventId.D not in roast_events)
+            & (self.count > 5)
+        ):
+            if self._ror_reversed():
+                roast_events[RoastEventId.D] = self.count - 3
+                detected.append(RoastEventId.D)
+                logger.info("auto detected drop at ror index: %s", self.count - 3)
 
-        if tp_found:
-            session.roast_events[RoastEventId.TP] = target_index
-            await store.socketio_server.emit(
-                "roast_events", jsonable_encoder(session.roast_events)
-            )
+        return detected
 
 
-def calculate_phases(t: float, last_temp: float, roast_events: dict):
+def calculate_phases(
+    t: float, last_temp: float, roast_events: dict, session: RoastSession
+):
 
     #   charge	tp	de	fc	drop	last point  phases
     #   ------------------------------------------------------------------
@@ -177,7 +132,10 @@ def calculate_phases(t: float, last_temp: float, roast_events: dict):
     # 7 o	    o	o	x	o	    drop time	drying + maillard
     # 8 o	    o	x	o	x	    timer	    drying + develop
 
-    session = store.session
+    def bt_point(index: int) -> Point:
+        p = session.bt_channel.data[index]
+        p.time -= session.time_offset
+        return p
 
     result = {
         "dry": Phase(0.0, 0.0, 0.0),
@@ -192,25 +150,25 @@ def calculate_phases(t: float, last_temp: float, roast_events: dict):
     drop: Point = None
 
     if RoastEventId.C in roast_events:
-        charge = session.bt_channel.data[roast_events[RoastEventId.C]]
+        charge = bt_point(roast_events[RoastEventId.C])
     else:
         logger.warning("no CHARGE event")
         return result
 
     if RoastEventId.TP in roast_events:
-        tp = session.bt_channel.data[roast_events[RoastEventId.TP]]
+        tp = bt_point(roast_events[RoastEventId.TP])
     else:
         result["dry"] = Phase(session.timer - charge.time, 100.0, 0.0)
         return result
 
     if RoastEventId.DE in roast_events:
-        de = session.bt_channel.data[roast_events[RoastEventId.DE]]
+        de = bt_point(roast_events[RoastEventId.DE])
 
     if RoastEventId.FC in roast_events:
-        fc = session.bt_channel.data[roast_events[RoastEventId.FC]]
+        fc = bt_point(roast_events[RoastEventId.FC])
 
     if RoastEventId.D in roast_events:
-        drop = session.bt_channel.data[roast_events[RoastEventId.D]]
+        drop = bt_point(roast_events[RoastEventId.D])
         t = drop.time
         last_temp = drop.value
 
@@ -1,5 +1,12 @@
+import uuid
 from datetime import datetime
 from enum import Enum
+from time import monotonic
+
+import numpy
+
+from app.filters import HampelFilter, HanningSmoother
+from app.ror import RorEstimator
 
 
 class Point:
@@ -15,26 +22,193 @@ class Point:
         return f"({self.timestamp}, {self.time}, {self.value})"
 
 
+class Series:
+    # growable columnar buffer, capacity doubles whenever it runs full
+    def __init__(self, capacity: int = 256):
+        self.length: int = 0
+        self._timestamp: numpy.ndarray = numpy.zeros(capacity)  # epoch seconds
+        self._time: numpy.ndarray = numpy.zeros(capacity)
+        self._value: numpy.ndarray = numpy.zeros(capacity)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index: int) -> Point:
+        if index < 0:
+            index += self.length
+        if (index < 0) | (index >= self.length):
+            raise IndexError(index)
+        return Point(
+            datetime.fromtimestamp(self._timestamp[index]),
+            float(self._time[index]),
+            float(self._value[index]),
+        )
+
+    def __repr__(self):
+        return f"Series({list(zip(self.time.tolist(), self.value.tolist()))})"
+
+    @property
+    def capacity(self) -> int:
+        return len(self._value)
+
+    @property
+    def timestamp(self) -> numpy.ndarray:
+        return self._timestamp[: self.length]
+
+    @property
+    def time(self) -> numpy.ndarray:
+        return self._time[: self.length]
+
+    @property
+    def value(self) -> numpy.ndarray:
+        return self._value[: self.length]
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        for name in ("_timestamp", "_time", "_value"):
+            column = numpy.zeros(capacity)
+            column[: self.length] = getattr(self, name)[: self.length]
+            setattr(self, name, column)
+
+    def append(self, timestamp: float, time: float, value: float):
+        if self.length == self.capacity:
+            self._grow()
+        self._timestamp[self.length] = timestamp
+        self._time[self.length] = time
+        self._value[self.length] = value
+        self.length += 1
+
+    def extend(
+        self, timestamp: numpy.ndarray, time: numpy.ndarray, value: numpy.ndarray
+    ):
+        while self.length + len(value) > self.capacity:
+            self._grow()
+        stop = self.length + len(value)
+        self._timestamp[self.length : stop] = timestamp
+        self._time[self.length : stop] = time
+        self._value[self.length : stop] = value
+        self.length = stop
+
+
+class DerivedSeries:
+    # value column computed from a parent Series, timestamp and time are views
+    # into the parent columns, visible range is [start, stop)
+    def __init__(self, parent: Series):
+        self.parent: Series = parent
+        self.start: int = 0
+        self.stop: int = 0
+        self.changed: int = 0  # lowest parent index written since take_changed()
+        self._value: numpy.ndarray = numpy.zeros(parent.capacity)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index: int) -> Point:
+        if index < 0:
+            index += len(self)
+        if (index < 0) | (index >= len(self)):
+            raise IndexError(index)
+        p = self.parent[self.start + index]
+        return Point(p.timestamp, p.time, float(self._value[self.start + index]))
+
+    @property
+    def timestamp(self) -> numpy.ndarray:
+        return self.parent.timestamp[self.start : self.stop]
+
+    @property
+    def time(self) -> numpy.ndarray:
+        return self.parent.time[self.start : self.stop]
+
+    @property
+    def value(self) -> numpy.ndarray:
+        return self._value[self.start : self.stop]
+
+    def update(self, values: numpy.ndarray, start: int = 0):
+        # write values from parent index start onwards
+        stop = start + len(values)
+        if stop > len(self._value):
+            column = numpy.zeros(self.parent.capacity)
+            column[: len(self._value)] = self._value
+            self._value = column
+        self._value[start:stop] = values
+        self.changed = min(self.changed, start)
+
+    def take_changed(self) -> int:
+        changed = self.changed
+        self.changed = len(self._value)
+        return changed
+
+
 class Channel:
-    def __init__(self, id: str, color: str):
+    def __init__(
+        self,
+        id: str,
+        color: str,
+        ror_estimator: str = "delta",
+        ror_window: float = 8.0,
+    ):
         self.id: str = id
         self.color: str = color
 
         self.current_data: float = 0
         self.current_ror: float = 0
-        self.data_window: list[Point] = []  # for calculate current ror
+        # range of the device reads averaged into current_data
+        self.current_min: float = 0
+        self.current_max: float = 0
+        # for calculate current ror
+        self.ror_estimator: RorEstimator = RorEstimator(ror_estimator, ror_window)
+
+        self.data: Series = Series()
+        self.ror: Series = Series()
+        self.ror_filtered: DerivedSeries = DerivedSeries(self.ror)
+        # filter outliers, window of 7 samples
+        self.ror_filter: HampelFilter = HampelFilter(window_size=3, n_sigmas=2)
+        self.ror_smoothed: DerivedSeries = DerivedSeries(self.ror)
+        self.ror_smoother: HanningSmoother = HanningSmoother(window_len=11)
+
+    def _process(self, start: int):
+        # filter outliers and smooth the ror samples from index start on,
+        # a sample stays raw until its filter window is complete
+        ror = self.ror.value
+        changed = start
+        self.ror_filtered.update(ror[start:], start)
+        for value in ror[start:].tolist():
+            finalized = self.ror_filter.push(value)
+            if finalized is not None:
+                index, value = finalized
+                self.ror_filtered.update([value], index)
+                changed = min(changed, index)
+        self.ror_filtered.stop = len(ror)
+
+        # smooth curve, only the tail reached by the changed samples
+        if len(self.ror_filtered) >= self.ror_smoother.window_len:
+            tail, values = self.ror_smoother.update(self.ror_filtered.value, changed)
+            self.ror_smoothed.update(values, tail)
+            self.ror_smoothed.stop = len(ror)
+
+    def append(self, timestamp: float, time: float, value: float, ror: float):
+        self.data.append(timestamp, time, value)
+        self.ror.append(timestamp, time, ror)
+        self._process(len(self.ror) - 1)
 
-        self.data: list[Point] = []
-        self.ror: list[Point] = []
-        self.ror_filtered: list[Point] = []
-        self.ror_smoothed: list[Point] = []
+    def extend(
+        self,
+        timestamp: numpy.ndarray,
+        time: numpy.ndarray,
+        value: numpy.ndarray,
+        ror: numpy.ndarray,
+    ):
+        start = len(self.ror)
+        self.data.extend(timestamp, time, value)
+        self.ror.extend(timestamp, time, ror)
+        self._process(start)
 
 
 class ManualChannel:
     def __init__(self, id: str, current_data: float):
         self.id: str = id
         self.current_data: float = current_data
-        self.data: list[Point] = []
+        self.data: Series = Series(capacity=32)
 
 
 class RoastEventId(Enum):
@@ -63,7 +237,12 @@ class Phase:
 
 class RoastSession:
     def __init__(self):
+        self.id: str = uuid.uuid4().hex
+        self.version: int = 0  # bumped whenever a series changes
         self.start_time: datetime = datetime.now()
+        self.start_clock: float = monotonic()  # start_time on the monotonic clock
+        # series time is seconds since start, roast time is time - time_offset
+        self.time_offset: float = 0.0  # time of CHARGE
         self.timer: float = 0.0
         self.channels: list[Channel] = []
         self.bt_channel: Channel = None
@@ -74,6 +253,8 @@ class RoastSession:
             "mai": Phase(0.0, 0.0, 0.0),
             "dev": Phase(0.0, 0.0, 0.0),
         }
+        # live minus the reference profile at the same roast time, if any
+        self.deviation: dict = {"bt": None, "ror": None}
 
 
 class AppStatus(Enum):
@@ -1,10 +1,15 @@
-import codecs
-import ast
-from typing import Any, Dict
+import logging
+import struct
+import time
+from typing import Dict
 import pymodbus.client as ModbusClient
 from pymodbus import FramerType, ModbusException
-from pymodbus.constants import Endian
-from pymodbus.payload import BinaryPayloadDecoder
+from pymodbus.exceptions import ModbusIOException
+
+from app.alog import Alog, load_alog
+from app.metrics import MODBUS_ERRORS
+
+logger = logging.getLogger("uvicorn")
 
 
 class Device:
@@ -20,48 +25,60 @@ class Device:
 
 
 class ArtisanLog(Device):
+    # replays a recorded roast, one sample per read
     def __init__(self, filename: str) -> None:
 
         self.filename: str = filename
-        self.bt: list[float] = []
-        self.et: list[float] = []
-        self.inlet: list[float] = []
-
-    async def connect(self) -> bool:
-        with codecs.open(self.filename, "rb", encoding="utf-8") as file:
+        self.log: Alog = None
+        self.index: int = 0  # next sample to read
 
-            result: Dict[str, Any] = ast.literal_eval(file.read())
+    @property
+    def remaining(self) -> int:
+        return 0 if self.log is None else len(self.log) - self.index
 
-            self.bt: list[float] = result["temp2"]
-            self.et: list[float] = result["temp1"]
-            self.inlet: list[float] = result["extratemp1"][0]
-            return True
+    async def connect(self) -> bool:
+        self.log = load_alog(self.filename)
+        self.index = 0
+        return True
 
     async def close(self) -> bool:
         return True
 
     async def read(self) -> dict:
-        if len(self.bt) > 0:
+        if self.remaining > 0:
+            i = self.index
+            self.index += 1
             return {
-                "BT": self.bt.pop(0),
-                "ET": self.et.pop(0),
-                "INLET": self.inlet.pop(0),
+                "BT": float(self.log.bt[i]),
+                "ET": float(self.log.et[i]),
+                "INLET": float(self.log.extratemp[0][i]),
             }
         return {}
 
 
 class Kapok501(Device):
-    def __init__(self, port: str) -> None:
+    # one controller per channel on the same bus, process value at register 18176
+    register = 18176
+    slaves = {"BT": 2, "ET": 1, "INLET": 3}
+
+    # registers arrive as unsigned 16 bit words, values are signed 16 bit * 0.1
+    word = struct.Struct(">H")
+    int16 = struct.Struct(">h")
+
+    def __init__(self, port: str, timeout: float = 3, retries: int = 3) -> None:
         self.port = port
+        self.timeout = timeout
+        self.retries = retries
         self.client = None
+        self.timings: dict[str, float] = {}  # seconds taken by the last read per slave
 
     async def connect(self) -> bool:
         if self.client is None:
             self.client = ModbusClient.AsyncModbusSerialClient(
                 self.port,
                 framer=FramerType.ASCII,
-                # timeout=10,
-                # retries=3,
+                timeout=self.timeout,
+                retries=self.retries,
                 # retry_on_empty=False,
                 # strict=True,
                 baudrate=9600,
@@ -78,24 +95,44 @@ class Kapok501(Device):
         return True
 
     async def read(self) -> Dict:
+        # a serial bus carries one request at a time, so the slaves are polled
+        # back to back with nothing else in between
         async def read(slave: int) -> float:
 
             try:
                 # See all calls in client_calls.py
-                rr = await self.client.read_holding_registers(18176, 1, slave)
+                rr = await self.client.read_holding_registers(self.register, 1, slave)
+            except ModbusIOException as e:
+                # no (complete) response within timeout
+                MODBUS_ERRORS.inc((self.port, "timeout"))
+                logger.warning(
+                    "%s: no response from slave %s (%s)", self.port, slave, e
+                )
+                return
             except ModbusException as e:
-                print(f"Received ModbusException({e}) from library")
+                MODBUS_ERRORS.inc((self.port, "exception"))
+                logger.warning("%s: slave %s: %s", self.port, slave, e)
                 return
 
-            value: float = (
-                BinaryPayloadDecoder.fromRegisters(
-                    rr.registers, byteorder=Endian.BIG, wordorder=Endian.BIG
-                ).decode_16bit_int()
-                * 0.1
-            )
-            return value
+            if rr.isError():
+                MODBUS_ERRORS.inc((self.port, "error_response"))
+                logger.warning(
+                    "%s: error response from slave %s (%s)", self.port, slave, rr
+                )
+                return
 
-        bt = await read(slave=2)
-        et = await read(slave=1)
-        inlet = await read(slave=3)
-        return {"BT": bt, "ET": et, "INLET": inlet}
+            return self.int16.unpack(self.word.pack(rr.registers[0]))[0] * 0.1
+
+        result = {}
+        frame_start = time.perf_counter()
+        for channel, slave in self.slaves.items():
+            start = time.perf_counter()
+            result[channel] = await read(slave)
+            self.timings[channel] = time.perf_counter() - start
+
+        logger.debug(
+            "kapok501 frame %.0f ms, per slave %s",
+            (time.perf_counter() - frame_start) * 1000,
+            {k: round(v * 1000) for k, v in self.timings.items()},
+        )
+        return result
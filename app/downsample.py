@@ -0,0 +1,188 @@
+from bisect import bisect_left, bisect_right
+
+import numpy
+
+from app.broadcast import APPENDED, REWRITTEN
+from app.classes import RoastEventId, RoastSession
+
+# a chart client that reports its plot width gets a view of every channel
+# series downsampled to about one point per pixel with largest triangle three
+# buckets (LTTB). the recent window stays at full resolution, so the live edge,
+# its labels and the rewritten tail of the smoothed ror are exact
+
+
+class DownsampledSeries:
+    # LTTB view of one series: buckets of a fixed duration are finalized to
+    # one point, the ones holding a kept index (a roast event) to that point,
+    # everything from raw_stop on is the series itself. finalized buckets never
+    # move unless the series is rewritten under them
+    def __init__(self, series, bucket: float, window: float):
+        self.series = series
+        self.bucket: float = bucket  # seconds per bucket
+        self.window: float = window  # seconds kept at full resolution
+
+        # finalized points and the series index each came from
+        self._time: numpy.ndarray = numpy.zeros(0)
+        self._value: numpy.ndarray = numpy.zeros(0)
+        self._timestamp: numpy.ndarray = numpy.zeros(0)
+        self.selected: list[int] = []
+        # per finalized bucket: series index it ends at, index of its first point
+        self.stops: list[int] = []
+        self.firsts: list[int] = []
+
+    @property
+    def raw_stop(self) -> int:
+        return self.stops[-1] if len(self.stops) > 0 else 0
+
+    def __len__(self):
+        return len(self.selected) + len(self.series) - self.raw_stop
+
+    @property
+    def time(self) -> numpy.ndarray:
+        return numpy.concatenate((self._time, self.series.time[self.raw_stop :]))
+
+    @property
+    def value(self) -> numpy.ndarray:
+        return numpy.concatenate((self._value, self.series.value[self.raw_stop :]))
+
+    @property
+    def timestamp(self) -> numpy.ndarray:
+        return numpy.concatenate(
+            (self._timestamp, self.series.timestamp[self.raw_stop :])
+        )
+
+    def index(self, raw: int) -> int:
+        # view index of series index raw, or of the point before it when raw
+        # was not kept
+        if raw >= self.raw_stop:
+            return len(self.selected) + raw - self.raw_stop
+        return max(0, bisect_right(self.selected, raw) - 1)
+
+    def update(self, changed: int, keep: list[int] = ()) -> int:
+        # the series changed from index changed on, returns the first view
+        # index that changed
+        before = len(self.selected)
+        raw_stop = self.raw_stop
+        first = before + max(0, changed - raw_stop)
+
+        selected = set(self.selected)
+        changed = min(
+            [changed] + [k for k in keep if k < raw_stop and k not in selected]
+        )
+        if changed < raw_stop:
+            # rewritten under finalized buckets, redo them
+            k = bisect_right(self.stops, changed)
+            first = self.firsts[k]
+            self._truncate(k)
+
+        if self._finalize(sorted(keep)):
+            first = min(first, before)
+        return min(first, len(self))
+
+    def _truncate(self, buckets: int):
+        points = (
+            self.firsts[buckets] if buckets < len(self.firsts) else len(self.selected)
+        )
+        self._time = self._time[:points]
+        self._value = self._value[:points]
+        self._timestamp = self._timestamp[:points]
+        del self.selected[points:]
+        del self.stops[buckets:]
+        del self.firsts[buckets:]
+
+    def _finalize(self, keep: list[int]) -> bool:
+        # finalizes in batches, once the raw tail is two windows long, down
+        # to one window. in between a delta only carries the new samples
+        time = self.series.time
+        value = self.series.value
+        n = len(time)
+        start = self.raw_stop
+        if (n == 0) or (time[-1] - time[start] < 2 * self.window):
+            return False
+
+        cutoff = time[-1] - self.window
+        origin = time[0]
+        selected = []
+        stops = []
+        while True:
+            b = numpy.floor((time[start] - origin) / self.bucket)
+            stop = int(numpy.searchsorted(time, origin + (b + 1) * self.bucket))
+            stop = max(stop, start + 1)
+            after = int(numpy.searchsorted(time, origin + (b + 2) * self.bucket))
+            if time[stop - 1] >= cutoff:
+                break
+
+            kept = keep[bisect_left(keep, start) : bisect_left(keep, stop)]
+            if len(kept) > 0:
+                points = kept
+            elif (len(self.selected) + len(selected) == 0) | (after <= stop):
+                # first point of the series, or no next bucket to aim at
+                points = [start]
+            else:
+                # the point of this bucket spanning the largest triangle with
+                # the last point kept and the mean of the next bucket
+                a = self.selected[-1] if len(selected) == 0 else selected[-1]
+                ax, ay = time[a], value[a]
+                cx = time[stop:after].mean()
+                cy = value[stop:after].mean()
+                area = numpy.abs(
+                    (ax - cx) * (value[start:stop] - ay)
+                    - (ax - time[start:stop]) * (cy - ay)
+                )
+                points = [start + int(numpy.argmax(numpy.nan_to_num(area, nan=-1)))]
+
+            stops.append((stop, len(self.selected) + len(selected)))
+            selected += points
+            start = stop
+
+        if len(stops) == 0:
+            return False
+        self._time = numpy.concatenate((self._time, time[selected]))
+        self._value = numpy.concatenate((self._value, value[selected]))
+        self._timestamp = numpy.concatenate(
+            (self._timestamp, self.series.timestamp[selected])
+        )
+        self.selected += selected
+        for stop, first in stops:
+            self.stops.append(stop)
+            self.firsts.append(first)
+        return True
+
+
+class SessionView:
+    # downsampled channel series of a session for one plot width, shared by
+    # every client of that width. the gas steps are few and stay raw
+    def __init__(
+        self, session: RoastSession, width: int, chart_seconds: float, window: float
+    ):
+        self.width: int = width
+        bucket = chart_seconds / width
+        self.series: dict[str, DownsampledSeries] = {}
+        for c in session.channels:
+            for name in APPENDED + REWRITTEN:
+                self.series[f"{c.id}.{name}"] = DownsampledSeries(
+                    getattr(c, name), bucket, max(window, 2 * bucket)
+                )
+        self.series["GAS.data"] = session.gas_channel.data
+        self.bt: str = f"{session.bt_channel.id}.data"
+        self.sent: dict[str, int] = {}  # view points already sent
+        self.update(session, {key: 0 for key in self.series})
+
+    def update(self, session: RoastSession, starts: dict[str, int]) -> dict[str, int]:
+        # moves the view on by one delta, given where the series changed, and
+        # returns where each view series changed
+        keep = sorted(session.roast_events.values())
+        view_starts = {}
+        for key, series in self.series.items():
+            if isinstance(series, DownsampledSeries):
+                first = series.update(starts[key], keep if key == self.bt else ())
+            else:
+                first = starts[key]
+            view_starts[key] = min(first, self.sent.get(key, len(series)))
+            self.sent[key] = len(series)
+        return view_starts
+
+    def roast_events(self, roast_events: dict[RoastEventId, int]) -> dict:
+        # BT indices of the events in the view's BT data
+        bt = self.series[self.bt]
+        return {e.value: bt.index(index) for e, index in roast_events.items()}
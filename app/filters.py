@@ -0,0 +1,121 @@
+from bisect import bisect_left, insort
+from collections import deque
+
+import numpy
+
+
+class HampelFilter:
+    # streaming version of calculate.hampel_filter_forloop, fed one sample at a time
+    #
+    # index i is filtered against the window [i - window_size, i + window_size),
+    # so it is final once sample i + window_size arrives. the window is kept
+    # sorted, median and MAD are read from it with binary searches. insert and
+    # remove shift the list, O(w), for a window of a few samples a memmove is
+    # faster than the O(log w) tree it would take.
+    def __init__(self, window_size: int, n_sigmas: float = 3):
+        self.window_size: int = window_size
+        self.n_sigmas: float = n_sigmas
+        self.count: int = 0  # samples pushed so far
+        self.recent: deque[float] = deque(maxlen=2 * window_size + 1)
+        self.window: list[float] = []  # sorted
+
+    def _median(self) -> float:
+        s = self.window
+        n = len(s)
+        if n % 2 == 1:
+            return s[n // 2]
+        return (s[n // 2 - 1] + s[n // 2]) / 2
+
+    def _deviation(self, median: float, split: int, k: int) -> float:
+        # k-th smallest |x - median|, merging deviations left and right of split
+        s = self.window
+        na, nb = split, len(s) - split
+
+        def left(i):
+            return median - s[split - 1 - i]
+
+        def right(i):
+            return s[split + i] - median
+
+        lo, hi = max(0, k + 1 - nb), min(k + 1, na)
+        while lo < hi:
+            a = (lo + hi) // 2
+            if left(a) < right(k - a):
+                lo = a + 1
+            else:
+                hi = a
+        a = lo
+        b = k + 1 - a
+        if a == 0:
+            return right(b - 1)
+        if b == 0:
+            return left(a - 1)
+        return max(left(a - 1), right(b - 1))
+
+    def _mad(self, median: float) -> float:
+        n = len(self.window)
+        split = bisect_left(self.window, median)
+        if n % 2 == 1:
+            return self._deviation(median, split, n // 2)
+        return (
+            self._deviation(median, split, n // 2 - 1)
+            + self._deviation(median, split, n // 2)
+        ) / 2
+
+    def push(self, value: float) -> tuple[int, float] | None:
+        # returns (index, filtered value) of the sample finalized by this one
+        k = 1.4826  # scale factor for Gaussian distribution
+
+        self.recent.append(value)
+        result = None
+
+        i = self.count - self.window_size
+        if i >= self.window_size:
+            x0 = self._median()
+            s0 = k * self._mad(x0)
+            xi = self.recent[self.window_size]
+            result = (i, x0 if abs(xi - x0) > self.n_sigmas * s0 else xi)
+
+        insort(self.window, value)
+        if len(self.window) > 2 * self.window_size:
+            self.window.pop(bisect_left(self.window, self.recent[0]))
+
+        self.count += 1
+        return result
+
+
+class HanningSmoother:
+    # incremental version of the reflected hanning smoothing
+    # https://scipy-cookbook.readthedocs.io/items/SignalSmooth.html
+    #
+    # output idx reads input [idx - half - 1, idx + half - 1], padded by reflecting
+    # both edges. a change at input c only reaches outputs from c - half + 1 on,
+    # and growing the input moves the right edge, so only that tail is recomputed.
+    def __init__(self, window_len: int = 11):
+        self.window_len: int = window_len  # should be odd number
+        w = numpy.hanning(window_len)
+        self.window: numpy.ndarray = w / w.sum()
+        self.length: int = 0  # input length at the last update
+
+    def update(self, x: numpy.ndarray, changed: int) -> tuple[int, numpy.ndarray]:
+        # changed: lowest input index modified since the last update
+        # returns (start, values) replacing outputs start .. len(x) - 1,
+        # nothing while the input is shorter than the window
+        n = len(x)
+        half = int(self.window_len / 2)
+        if n < self.window_len:
+            self.length = 0
+            return 0, numpy.zeros(0)
+
+        if changed < self.window_len:
+            # left reflection reads x[1 .. window_len - 1]
+            start = 0
+        else:
+            start = max(0, min(changed, self.length) - half + 1)
+
+        k = numpy.abs(numpy.arange(start - half - 1, n + half - 1))
+        k = numpy.where(k > n - 1, 2 * (n - 1) - k, k)
+        values = numpy.convolve(self.window, x[k], mode="valid")
+
+        self.length = n
+        return start, values
@@ -0,0 +1,187 @@
+import glob
+import json
+import logging
+import os
+import struct
+from datetime import datetime
+from time import monotonic
+
+import numpy
+
+from app.calculate import RoastEventDetector
+from app.classes import RoastEventId, RoastSession
+
+logger = logging.getLogger("uvicorn")
+
+# file layout: MAGIC, json header padded to HEADER_SIZE, fixed size records
+MAGIC = b"RCJ1"
+HEADER_SIZE = 256
+
+SAMPLE = 1  # channel, time, value, ror
+GAS = 2  # time, value
+EVENT = 3  # event, index
+FINISH = 4  # roast stopped cleanly
+
+RECORD = struct.Struct("<BBBxIddd")
+RECORD_DTYPE = numpy.dtype(
+    [
+        ("kind", "u1"),
+        ("channel", "u1"),
+        ("event", "u1"),
+        ("pad", "u1"),
+        ("index", "<u4"),
+        ("time", "<f8"),
+        ("value", "<f8"),
+        ("ror", "<f8"),
+    ]
+)
+EVENTS = list(RoastEventId)
+
+
+class Journal:
+    # append-only record of a roast, written every tick and fsynced in batches
+    def __init__(self, path: str, fsync_interval: float = 10):
+        self.path: str = path
+        self.fsync_interval: float = fsync_interval
+        # a record torn by a crash is cut off, appends start on a record
+        # boundary where the next recovery reads them
+        size = os.path.getsize(path)
+        torn = max(0, size - HEADER_SIZE) % RECORD.size
+        if torn > 0:
+            logger.warning("%s: torn record of %s bytes cut off", path, torn)
+            os.truncate(path, size - torn)
+        self.file = open(path, "ab")
+        self.buffer: bytearray = bytearray()
+        self.synced_at: float = monotonic()
+
+    @classmethod
+    def create(
+        cls, directory: str, session: RoastSession, fsync_interval: float = 10
+    ) -> "Journal":
+        os.makedirs(directory, exist_ok=True)
+        name = session.start_time.strftime("%y-%m-%d_%H%M%S") + ".rcj"
+        path = os.path.join(directory, name)
+
+        header = json.dumps(
+            {
+                "start_time": session.start_time.timestamp(),
+                "channels": [c.id for c in session.channels],
+            }
+        ).encode("utf-8")
+        with open(path, "wb") as file:
+            file.write(MAGIC + header.ljust(HEADER_SIZE - len(MAGIC)))
+            file.flush()
+            os.fsync(file.fileno())
+
+        return cls(path, fsync_interval)
+
+    def sample(self, channel: int, time: float, value: float, ror: float):
+        self.buffer += RECORD.pack(SAMPLE, channel, 0, 0, time, value, ror)
+
+    def gas(self, time: float, value: float):
+        self.buffer += RECORD.pack(GAS, 0, 0, 0, time, value, 0.0)
+
+    def event(self, event_id: RoastEventId, index: int):
+        self.buffer += RECORD.pack(EVENT, 0, EVENTS.index(event_id), index, 0, 0, 0)
+
+    def flush(self, sync: bool = False):
+        if len(self.buffer) > 0:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer = bytearray()
+        if sync | (monotonic() - self.synced_at >= self.fsync_interval):
+            os.fsync(self.file.fileno())
+            self.synced_at = monotonic()
+
+    def finish(self):
+        self.buffer += RECORD.pack(FINISH, 0, 0, 0, 0, 0, 0)
+        self.flush(sync=True)
+        self.file.close()
+
+
+def _records(path: str) -> numpy.ndarray:
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD.size
+    if count <= 0:
+        return numpy.zeros(0, dtype=RECORD_DTYPE)
+    # a record torn by the crash is past count and ignored
+    return numpy.memmap(
+        path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,)
+    )
+
+
+def find_unfinished(directory: str) -> str | None:
+    # the newest journal, unless it ends with FINISH
+    paths = sorted(glob.glob(os.path.join(directory, "*.rcj")))
+    if len(paths) == 0:
+        return None
+    records = _records(paths[-1])
+    if (len(records) > 0) and (records[-1]["kind"] == FINISH):
+        return None
+    return paths[-1]
+
+
+def recover(
+    path: str,
+    session: RoastSession,
+    detector: RoastEventDetector,
+    clock_now: float,
+):
+    # rebuild session from the journal at path, so recording carries on
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a roast journal")
+        header = json.loads(file.read(HEADER_SIZE - len(MAGIC)))
+
+    records = _records(path)
+    start = header["start_time"]
+
+    # same elapsed time as before the restart, bridged by the wall clock
+    session.start_time = datetime.fromtimestamp(start)
+    session.start_clock = clock_now - (datetime.now().timestamp() - start)
+
+    kind = records["kind"]
+    for k, channel_id in enumerate(header["channels"]):
+        c = next(c for c in session.channels if c.id == channel_id)
+        samples = records[(kind == SAMPLE) & (records["channel"] == k)]
+        time = numpy.array(samples["time"])
+        ror = numpy.array(samples["ror"])
+        c.extend(start + time, time, numpy.array(samples["value"]), ror)
+
+        if len(time) > 0:
+            c.current_data = float(c.data.value[-1])
+            c.current_ror = float(ror[-1])
+            # refill the ror window, on the clock it is fed with. twice its
+            # length, the estimator keeps what its margin reaches
+            recent = time >= time[-1] - 2 * c.ror_estimator.window
+            for t, v in zip(time[recent], c.data.value[recent]):
+                c.ror_estimator.push(session.start_clock + t, v)
+            c.ror_estimator.ror = c.current_ror
+
+    gas = records[kind == GAS]
+    session.gas_channel.data.extend(start + gas["time"], gas["time"], gas["value"])
+    if len(gas) > 0:
+        session.gas_channel.current_data = float(gas["value"][-1])
+    session.version += 1
+
+    # the last record of an event wins, CHARGE may have been moved
+    for record in records[kind == EVENT]:
+        session.roast_events[EVENTS[record["event"]]] = int(record["index"])
+
+    bt = session.bt_channel
+    if RoastEventId.C in session.roast_events:
+        session.time_offset = float(bt.data.time[session.roast_events[RoastEventId.C]])
+
+    # bring the detector to the same state, the events are known already
+    known = dict(session.roast_events)
+    for value, ror in zip(bt.data.value.tolist(), bt.ror.value.tolist()):
+        detector.push(value, ror, known)
+
+    if len(bt.data) > 0:
+        session.timer = float(bt.data.time[-1]) - session.time_offset
+
+    logger.info(
+        "recovered %s: %s records, events %s",
+        path,
+        len(records),
+        session.roast_events,
+    )
@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy
+from fastapi.encoders import jsonable_encoder
+
+from app.classes import RoastEventId, RoastSession
+
+logger = logging.getLogger("uvicorn")
+
+# summary columns, listed and sorted without touching the curves
+SUMMARY = (
+    "id",
+    "start_time",
+    "roaster",
+    "bean",
+    "total_time",
+    "dtr",
+    "charge_temp",
+    "drop_temp",
+    "dry_time",
+    "mai_time",
+    "dev_time",
+    "dry_ror",
+    "mai_ror",
+    "dev_ror",
+)
+SORTABLE = ("start_time", "bean", "total_time", "dtr", "drop_temp")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roasts (
+    id INTEGER PRIMARY KEY,
+    start_time REAL NOT NULL,
+    roaster TEXT NOT NULL DEFAULT '',
+    bean TEXT NOT NULL DEFAULT '',
+    total_time REAL,
+    dtr REAL,
+    charge_temp REAL,
+    drop_temp REAL,
+    dry_time REAL,
+    mai_time REAL,
+    dev_time REAL,
+    dry_ror REAL,
+    mai_ror REAL,
+    dev_ror REAL,
+    time_offset REAL NOT NULL,
+    roast_events TEXT NOT NULL,
+    phases TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS roasts_start_time ON roasts (start_time);
+CREATE INDEX IF NOT EXISTS roasts_roaster ON roasts (roaster, start_time);
+CREATE INDEX IF NOT EXISTS roasts_bean ON roasts (bean, start_time);
+CREATE INDEX IF NOT EXISTS roasts_dtr ON roasts (dtr);
+CREATE INDEX IF NOT EXISTS roasts_total_time ON roasts (total_time);
+CREATE INDEX IF NOT EXISTS roasts_drop_temp ON roasts (drop_temp);
+
+-- one row per channel, columns stored as float64 blobs
+CREATE TABLE IF NOT EXISTS curves (
+    roast_id INTEGER NOT NULL REFERENCES roasts (id) ON DELETE CASCADE,
+    channel TEXT NOT NULL,
+    time BLOB NOT NULL,
+    value BLOB NOT NULL,
+    ror BLOB,
+    PRIMARY KEY (roast_id, channel)
+);
+"""
+
+
+def _blob(array: numpy.ndarray) -> bytes:
+    return numpy.ascontiguousarray(array, dtype="<f8").tobytes()
+
+
+def _array(blob: bytes | None) -> numpy.ndarray | None:
+    if blob is None:
+        return None
+    return numpy.frombuffer(blob, dtype="<f8")
+
+
+def roast_summary(session: RoastSession) -> dict:
+    # derived stats of a finished session, times are roast time (from CHARGE)
+    bt = session.bt_channel
+    events = session.roast_events
+    phases = session.phases
+
+    summary = {
+        "total_time": None,
+        "dtr": None,
+        "charge_temp": None,
+        "drop_temp": None,
+        "dry_time": phases["dry"].time,
+        "mai_time": phases["mai"].time,
+        "dev_time": phases["dev"].time,
+        "dry_ror": None,
+        "mai_ror": None,
+        "dev_ror": None,
+    }
+    if (len(bt.data) == 0) | (RoastEventId.C not in events):
+        return summary
+
+    end = events.get(RoastEventId.D, len(bt.data) - 1)
+    summary["total_time"] = float(bt.data.time[end]) - session.time_offset
+    summary["charge_temp"] = float(bt.data.value[events[RoastEventId.C]])
+    if RoastEventId.D in events:
+        summary["drop_temp"] = float(bt.data.value[end])
+    if RoastEventId.FC in events:
+        summary["dtr"] = phases["dev"].percent
+
+    # mean ror of each phase, on the smoothed curve when there is one
+    ror = bt.ror_smoothed.value if len(bt.ror_smoothed) == len(bt.ror) else bt.ror.value
+    bounds = {
+        "dry": (RoastEventId.C, (RoastEventId.DE, RoastEventId.FC)),
+        "mai": (RoastEventId.DE, (RoastEventId.FC,)),
+        "dev": (RoastEventId.FC, ()),
+    }
+    for phase, (first, nexts) in bounds.items():
+        if first not in events:
+            continue
+        stop = next((events[e] for e in nexts if e in events), end)
+        if stop > events[first]:
+            summary[f"{phase}_ror"] = float(ror[events[first] : stop + 1].mean())
+
+    return summary
+
+
+class RoastLibrary:
+    # sqlite archive of finished roasts, a summary row with indexed stats per
+    # roast and the curves in a separate table, so listing never loads them
+    def __init__(self, path: str):
+        self.path: str = path
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        # shared by the event loop and the threadpool running the routes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def archive(self, session: RoastSession, bean: str = "", roaster: str = "") -> int:
+        summary = roast_summary(session)
+        row = {
+            "start_time": session.start_time.timestamp(),
+            "roaster": roaster,
+            "bean": bean,
+            **summary,
+            "time_offset": session.time_offset,
+            "roast_events": json.dumps(jsonable_encoder(session.roast_events)),
+            "phases": json.dumps(jsonable_encoder(session.phases)),
+        }
+        columns = ", ".join(row)
+        params = ", ".join(f":{name}" for name in row)
+
+        curves = [
+            (c.id, _blob(c.data.time), _blob(c.data.value), _blob(c.ror.value))
+            for c in session.channels
+        ]
+        gas = session.gas_channel
+        curves.append((gas.id, _blob(gas.data.time), _blob(gas.data.value), None))
+
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                f"INSERT INTO roasts ({columns}) VALUES ({params})", row
+            )
+            roast_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO curves (roast_id, channel, time, value, ror)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(roast_id, *curve) for curve in curves],
+            )
+
+        logger.info("archived roast %s: %s", roast_id, summary)
+        return roast_id
+
+    def roasts(
+        self,
+        offset: int = 0,
+        limit: int = 50,
+        roaster: str | None = None,
+        bean: str | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        min_dtr: float | None = None,
+        max_dtr: float | None = None,
+        sort: str = "start_time",
+        descending: bool = True,
+    ) -> tuple[int, list[dict]]:
+        # (total matching, one page of summaries)
+        if sort not in SORTABLE:
+            raise ValueError(f"cannot sort by {sort}")
+
+        where = []
+        args = {}
+        for column, op, name, value in (
+            ("roaster", "=", "roaster", roaster),
+            ("bean", "=", "bean", bean),
+            ("start_time", ">=", "since", since),
+            ("start_time", "<", "until", until),
+            ("dtr", ">=", "min_dtr", min_dtr),
+            ("dtr", "<=", "max_dtr", max_dtr),
+        ):
+            if value is not None:
+                where.append(f"{column} {op} :{name}")
+                args[name] = value
+        clause = f"WHERE {' AND '.join(where)}" if len(where) > 0 else ""
+        order = "DESC" if descending else "ASC"
+
+        with self.lock:
+            total = self.db.execute(
+                f"SELECT count(*) FROM roasts {clause}", args
+            ).fetchone()[0]
+            rows = self.db.execute(
+                f"SELECT {', '.join(SUMMARY)} FROM roasts {clause}"
+                f" ORDER BY {sort} {order}, id {order} LIMIT :limit OFFSET :offset",
+                {**args, "limit": limit, "offset": offset},
+            ).fetchall()
+        return total, [dict(r) for r in rows]
+
+    def roast(self, roast_id: int) -> dict | None:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM roasts WHERE id = ?", (roast_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        roast = dict(row)
+        roast["roast_events"] = json.loads(roast["roast_events"])
+        roast["phases"] = json.loads(roast["phases"])
+        return roast
+
+    def curves(self, roast_id: int) -> dict[str, dict[str, numpy.ndarray]]:
+        # channel id -> time, value and ror columns (ror is None for gas)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT channel, time, value, ror FROM curves WHERE roast_id = ?",
+                (roast_id,),
+            ).fetchall()
+        return {
+            r["channel"]: {
+                "time": _array(r["time"]),
+                "value": _array(r["value"]),
+                "ror": _array(r["ror"]),
+            }
+            for r in rows
+        }
+
+    def set_bean(self, roast_id: int, bean: str) -> bool:
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "UPDATE roasts SET bean = ? WHERE id = ?", (bean, roast_id)
+            )
+        return cursor.rowcount > 0
+
+    def delete(self, roast_id: int) -> bool:
+        with self.lock, self.db:
+            cursor = self.db.execute("DELETE FROM roasts WHERE id = ?", (roast_id,))
+        return cursor.rowcount > 0
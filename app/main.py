@@ -1,34 +1,27 @@
 import json
 import asyncio
-from datetime import datetime
-import typing
+import functools
+from urllib.parse import parse_qs
+import time
 
 import logging
 import socketio
 
 from fastapi import FastAPI, Request
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.concurrency import asynccontextmanager
-from fastapi.encoders import jsonable_encoder
-
-import numpy
 
 from app import store
+from app.assets import Assets
+from app.library import RoastLibrary
+from app.metrics import CLIENTS, HANDLER_SECONDS, SLOW_HANDLERS, PayloadJson
+from app.pubsub import BrokerManager, Remote
+from app.roaster import plot_width, roaster_settings
+from app.scheduler import LoopMonitor
+from app.wire import WIRES, room
 
-from app.calculate import (
-    auto_detect_charge,
-    auto_detect_drop,
-    auto_detect_dry_end,
-    auto_detect_turning_point,
-    calculate_phases,
-    hampel_filter_forloop_point,
-)
-from app.device import ArtisanLog, Device, Kapok501
-from app.classes import RoastSession, RoastEventId, Point, Channel, AppStatus
-
-from app.routers import settings
+from app.routers import library, metrics, reference, replay, session, settings
 
 logger = logging.getLogger("uvicorn")
 
@@ -37,18 +30,58 @@ logger = logging.getLogger("uvicorn")
 async def lifespan(app: FastAPI):  # pylint: disable=redefined-outer-name
     # Lifespan startup actions
     store.loop = asyncio.get_running_loop()
+    if not SEPARATE:
+        await store.acquisition.begin()
+
+    processing = store.settings["processing"]
+    monitor = LoopMonitor(
+        processing["loop_monitor_interval"],
+        processing["max_handler_latency"],
+        clock=store.clock,
+    )
+    monitor_task = store.loop.create_task(monitor.run())
 
     yield
     # Lifespan cleanup actions
+    monitor_task.cancel()
+    if not SEPARATE:
+        await store.acquisition.end()
+    store.library.close()
 
 
-socketio_server = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+# store init
+with open("app/settings.json", "rb") as f:
+    store.settings = json.load(f)
+    logger.info(settings)
+
+# with acquisition.separate this is one of any number of web workers, the
+# roasters run in the acquisition process (app/acquisition.py) and reach the
+# clients through its broker
+SEPARATE = store.settings["acquisition"]["separate"]
+if SEPARATE:
+    client_manager = BrokerManager(store.settings["acquisition"]["socket"])
+else:
+    client_manager = None
+
+socketio_server = socketio.AsyncServer(
+    async_mode="asgi",
+    cors_allowed_origins="*",
+    json=PayloadJson,
+    client_manager=client_manager,
+)
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(settings.router)
+app.include_router(session.router)
+app.include_router(library.router)
+app.include_router(replay.router)
+app.include_router(reference.router)
+app.include_router(metrics.router)
 templates = Jinja2Templates(directory="app/templates")
 
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+static = Assets(directory="app/static")
+templates.env.globals["asset"] = static.versioned
+app.mount("/static", static, name="static")
 
 socketio_app = socketio.ASGIApp(
     socketio_server=socketio_server, socketio_path="/socket.io"
@@ -58,266 +91,164 @@ socketio_app = socketio.ASGIApp(
 # path needs to match socketio_path in socketio.ASGIApp above
 app.mount("/socket.io", socketio_app)
 
-# store init
-with open("app/settings.json", "rb") as f:
-    store.settings = json.load(f)
-    logger.info(settings)
-
-if store.settings["device"] == "Kapok501":
-    logger.info("device: Kapok501")
-
-    device: Device = Kapok501(store.settings["serial"]["port"])
-    store.device = device
-else:
-    logger.info("device: ArtisanLog")
-    device: Device = ArtisanLog("util/24-08-04_0946_mozart.alog")
-    store.device = device
-
 # initialization
 store.socketio_server = socketio_server
+store.clock = time.monotonic
 
-store.app_status = AppStatus.OFF
-
-store.session = RoastSession()
-for ch in store.settings["channels"]:
-    c = Channel(id=ch["id"], color=ch["color"])
-    store.session.channels.append(c)
-    if ch["id"] == "BT":
-        store.session.bt_channel = c
-
+store.library = RoastLibrary(store.settings["library"]["path"])
 
-@socketio_server.on("gas_value")
-def gas_value(sid, data):
-    store.session.gas_channel.current_data = data
-    store.session.gas_channel.data.append(
-        Point(
-            datetime.now(), store.session.timer, store.session.gas_channel.current_data
-        )
-    )
-
-    logger.info("gas_channel : %s", store.session.gas_channel.data)
-
-
-@socketio_server.on("charge")
+if SEPARATE:
+    store.acquisition = Remote(client_manager)
+else:
+    # only imported where the roasters run, its metrics read them
+    from app import acquisition
+
+    acquisition.setup()
+    store.acquisition = acquisition
+store.clients = {}
+
+
+def roaster_of(sid) -> str:
+    return store.clients[sid][0]
+
+
+def settings_of(roaster_id: str) -> dict:
+    entry = next(e for e in store.settings["roasters"] if e["id"] == roaster_id)
+    return roaster_settings(store.settings, entry)
+
+
+def on(event: str):
+    # socket.io handler, timed against processing.max_handler_latency. the
+    # numeric work runs on the roaster's processing thread (Roaster.run), so a
+    # handler waits at most for the tick queued before it, the loop never does
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def timed(*args):
+            start = time.perf_counter()
+            try:
+                return await handler(*args)
+            finally:
+                seconds = time.perf_counter() - start
+                HANDLER_SECONDS.observe(seconds, event)
+                if seconds > store.settings["processing"]["max_handler_latency"]:
+                    SLOW_HANDLERS.inc(event)
+                    logger.warning("%s handler took %.3f s", event, seconds)
+
+        socketio_server.on(event, timed)
+        return handler
+
+    return decorator
+
+
+@on("connect")
+async def on_connect(sid, environ):
+    # clients pick their roaster with ?roaster=<id>, default is the first one,
+    # how session updates reach them with ?wire=binary|json, and the width of
+    # their plot in pixels with ?width=<px> for a downsampled view
+    query = parse_qs(environ.get("QUERY_STRING", ""))
+    roasters = [e["id"] for e in store.settings["roasters"]]
+    roaster_id = query.get("roaster", roasters[:1])[0]
+    if roaster_id not in roasters:
+        raise socketio.exceptions.ConnectionRefusedError(f"no roaster {roaster_id}")
+    wire = query.get("wire", [WIRES[0]])[0]
+    if wire not in WIRES:
+        raise socketio.exceptions.ConnectionRefusedError(f"no wire format {wire}")
+
+    try:
+        width = plot_width(settings_of(roaster_id), int(query.get("width", [0])[0]))
+    except ValueError:
+        width = 0
+
+    store.clients[sid] = (roaster_id, wire, width)
+    await socketio_server.enter_room(sid, roaster_id)
+    await socketio_server.enter_room(sid, room(roaster_id, wire, width))
+    CLIENTS.inc(roaster_id)
+
+    try:
+        snapshot = await store.acquisition.subscribe(roaster_id, wire, width)
+    except OSError as e:
+        await on_disconnect(sid)
+        raise socketio.exceptions.ConnectionRefusedError("no acquisition") from e
+    # to this client only, not through the broker
+    await socketio_server.emit("read_device", snapshot, to=sid, ignore_queue=True)
+
+
+@on("disconnect")
+async def on_disconnect(sid):
+    client = store.clients.pop(sid, None)
+    if client is not None:
+        CLIENTS.inc(client[0], amount=-1)
+        try:
+            await store.acquisition.unsubscribe(*client)
+        except OSError:
+            pass  # gone with the acquisition process
+
+
+@on("resync")
+async def on_resync(sid, data):
+    snapshot = await store.acquisition.snapshot(*store.clients[sid])
+    await socketio_server.emit("read_device", snapshot, to=sid, ignore_queue=True)
+
+
+@on("gas_value")
+async def gas_value(sid, data):
+    await store.acquisition.gas_value(roaster_of(sid), data)
+
+
+@on("charge")
 async def on_charge(sid, data):
-    session: RoastSession = store.session
-
-    if data == "charge":
-        index = len(session.bt_channel.data) - 1
-    elif data == "to_left":
-        index = session.roast_events[RoastEventId.C] - 1
-    else:  # data == "to_right"
-        index = session.roast_events[RoastEventId.C] + 1
-
-    charge_point = session.bt_channel.data[index]
-    logger.info("CHARGE at BT index : %s", index)
-    logger.info("CHARGE at Point : %s", charge_point)
+    # data == "charge", "to_left" or "to_right"
+    await store.acquisition.charge(roaster_of(sid), data)
 
-    # re calculate time
-    session.start_time = charge_point.timestamp
-    for channel in session.channels:
-        for point in channel.data:
-            point.time = (point.timestamp - session.start_time).total_seconds()
-        for point in channel.ror:
-            point.time = (point.timestamp - session.start_time).total_seconds()
 
-    for point in session.gas_channel.data:
-        point.time = (point.timestamp - session.start_time).total_seconds()
-
-    session.roast_events[RoastEventId.C] = index
-
-    await socketio_server.emit("roast_events", jsonable_encoder(session.roast_events))
-
-
-@socketio_server.on("first_crack")
+@on("first_crack")
 async def on_first_crack(sid, data):
-
-    session: RoastSession = store.session
-
-    index = len(session.bt_channel.data) - 1
-    session.roast_events[RoastEventId.FC] = index
-
-    logger.info("FIRST CRACK at BT index : %s", index)
-
-    await socketio_server.emit("roast_events", jsonable_encoder(session.roast_events))
+    await store.acquisition.first_crack(roaster_of(sid))
 
 
-@socketio_server.on("drop")
+@on("drop")
 async def on_drop(sid, data):
-    session: RoastSession = store.session
-
-    index = len(session.bt_channel.data) - 1
-    session.roast_events[RoastEventId.D] = index
-
-    logger.info("DROP at BT index : %s", index)
-
-    await socketio_server.emit("roast_events", jsonable_encoder(session.roast_events))
+    await store.acquisition.drop(roaster_of(sid))
 
 
 @app.get("/", response_class=HTMLResponse)
-async def root(request: Request):
+async def root(request: Request, roaster: str | None = None):
+    names = {e["id"]: e.get("name", e["id"]) for e in store.settings["roasters"]}
+    if roaster not in names:
+        roaster = next(iter(names))
+    app_status = await store.acquisition.status()
     return templates.TemplateResponse(
         request=request,
         name="index.html.jinja2",
-        context={"ctx_settings": store.settings, "ctx_appstatus": store.app_status},
+        context={
+            "ctx_settings": settings_of(roaster),
+            "ctx_appstatus": app_status[roaster],
+            "ctx_roaster": roaster,
+            "ctx_roasters": names,
+        },
     )
 
 
-@socketio_server.on("on")
+@on("on")
 async def on_on(sid, data):
-    # TODO: implicit reset data
-
-    await store.device.connect()
-
-    store.read_device_task = store.loop.create_task(
-        ticker(interval=2.0, function_to_call=read_device)
-    )
-
-    store.app_status = AppStatus.ON
-    await socketio_server.emit("app_status", jsonable_encoder(store.app_status.name))
+    await store.acquisition.on(roaster_of(sid))
 
 
-@socketio_server.on("off")
+@on("off")
 async def on_off(sid, data):
-    store.read_device_task.cancel()
-    await store.device.close()
+    await store.acquisition.off(roaster_of(sid))
 
-    store.app_status = AppStatus.OFF
-    await socketio_server.emit("app_status", jsonable_encoder(store.app_status.name))
 
-
-@socketio_server.on("start")
+@on("start")
 async def on_start(sid, data):
-    store.session.start_time = datetime.now()
-
-    store.update_timer_task = store.loop.create_task(
-        ticker(interval=1.0, function_to_call=update_timer)
-    )
-
-    store.app_status = AppStatus.RECORDING
-
-    store.session.gas_channel.data.append(
-        Point(store.session.start_time, 0, store.session.gas_channel.current_data)
-    )
-
-    logger.info("gas_channel : %s", store.session.gas_channel.data)
-    await socketio_server.emit("app_status", jsonable_encoder(store.app_status.name))
+    await store.acquisition.start(roaster_of(sid))
 
 
-@socketio_server.on("stop")
+@on("stop")
 async def on_stop(sid, data):
-    store.read_device_task.cancel()
-    await store.device.close()
+    await store.acquisition.stop(roaster_of(sid))
 
-    store.update_timer_task.cancel()
 
-    store.app_status = AppStatus.OFF
-    await socketio_server.emit("app_status", jsonable_encoder(store.app_status.name))
-
-
-@socketio_server.on("reset")
+@on("reset")
 async def on_reset(sid, data):
-
-    store.session = RoastSession()
-    for ch in store.settings["channels"]:
-        c = Channel(id=ch["id"], color=ch["color"])
-        store.session.channels.append(c)
-        if ch["id"] == "BT":
-            store.session.bt_channel = c
-
-    await socketio_server.emit("update_timer", store.session.timer)
-    await socketio_server.emit("read_device", jsonable_encoder(store.session))
-    await socketio_server.emit("app_status", jsonable_encoder(store.app_status.name))
-
-
-async def ticker(interval: float, function_to_call: typing.Callable):
-    while True:
-        await function_to_call()
-        await asyncio.sleep(interval)
-
-
-async def read_device():
-
-    session: RoastSession = store.session
-
-    result = await store.device.read()
-    logger.info("result: %s", result)
-
-    now = datetime.now()
-    for c in session.channels:
-        c.current_data = result[c.id]
-
-        # calculate ror
-        c.data_window.append(Point(now, session.timer, result[c.id]))
-        if len(c.data_window) > 5:
-            c.data_window.pop(0)
-
-        delta = c.data_window[-1].value - c.data_window[0].value
-        time_elapsed_sec = (
-            c.data_window[-1].timestamp - c.data_window[0].timestamp
-        ).total_seconds()
-
-        if time_elapsed_sec > 0:
-            c.current_ror = delta * 60 / time_elapsed_sec  # ror time frame : 60 sec
-
-    if store.app_status == AppStatus.RECORDING:
-        session.timer = (now - session.start_time).total_seconds()
-        logger.info("roast_session timer : %s", session.timer)
-
-        for c in session.channels:
-            c.data.append(Point(now, session.timer, result[c.id]))
-            c.ror.append(Point(now, session.timer, c.current_ror))
-
-            # filter outliers
-            filter_window_size = 7  # shouled be odd number
-            n_sigmas = 2
-            if len(c.ror) >= filter_window_size:
-
-                c.ror_filtered, outliers = hampel_filter_forloop_point(
-                    c.ror, int(filter_window_size / 2), n_sigmas
-                )
-
-            # smooth curve
-            # https://scipy-cookbook.readthedocs.io/items/SignalSmooth.html
-            window_len = 11  # shouled be odd number
-            if len(c.ror_filtered) >= window_len:
-                x = []
-
-                for p in c.ror_filtered:
-                    x.append(p.value)
-
-                s = numpy.r_[
-                    x[window_len - 1 : 0 : -1], x, x[-2 : -window_len - 1 : -1]
-                ]
-                w = numpy.hanning(window_len)
-                y = numpy.convolve(w / w.sum(), s, mode="valid")
-                res = y[int(window_len / 2) - 1 : -int(window_len / 2)]
-
-                c.ror_smoothed = []
-                for idx, p in enumerate(c.ror_filtered):
-                    if p.time < 0:
-                        pass
-                    elif (
-                        RoastEventId.D in session.roast_events
-                        and idx > session.roast_events[RoastEventId.D] - 1
-                    ):
-                        pass
-                    else:
-                        c.ror_smoothed.append(Point(p.timestamp, p.time, res[idx]))
-
-    await auto_detect_charge()
-    await auto_detect_turning_point()
-    await auto_detect_dry_end()
-    await auto_detect_drop()
-    session.phases = calculate_phases(
-        session.timer, session.bt_channel.current_data, session.roast_events
-    )
-    logger.info(session.phases)
-
-    await socketio_server.emit("read_device", jsonable_encoder(session))
-
-
-async def update_timer():
-    session: RoastSession = store.session
-    session.timer = (datetime.now() - session.start_time).total_seconds()
-    await socketio_server.emit("update_timer", session.timer)
+    await store.acquisition.reset(roaster_of(sid))
@@ -0,0 +1,182 @@
+import json
+import math
+import typing
+from bisect import bisect_left
+
+# always-on process metrics in the prometheus text format, cheap enough to be
+# recorded on every tick: an observation is a bisect and two additions
+
+REGISTRY: list = []
+
+
+def _key(value: str | tuple) -> tuple:
+    # label values, one label may be given as a plain string
+    return (value,) if isinstance(value, str) else value
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra != "":
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple = (),
+        function: typing.Callable[[], dict[tuple, float]] | None = None,
+    ):
+        # function, when given, is read at scrape time instead of inc()
+        self.name: str = name
+        self.help: str = help
+        self.labels: tuple = labels
+        self.function = function
+        self.values: dict[tuple, float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, value: str | tuple = (), amount: float = 1):
+        key = _key(value)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        values = self.values if self.function is None else self.function()
+        return [
+            f"{self.name}{_labels(self.labels, _key(k))} {v}" for k, v in values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, amount: float, value: str | tuple = ()):
+        self.values[_key(value)] = amount
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        self.name: str = name
+        self.help: str = help
+        self.labels: tuple = labels
+        self.buckets: tuple = buckets  # upper bounds, ascending
+        # label value -> per bucket counts (last is +Inf), sum
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = {}
+        REGISTRY.append(self)
+
+    def observe(self, amount: float, value: str | tuple = ()):
+        key = _key(value)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        counts[bisect_left(self.buckets, amount)] += 1
+        self.sums[key] += amount
+
+    def render(self) -> list[str]:
+        lines = []
+        for value, counts in self.counts.items():
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                total += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                labels = _labels(self.labels, value, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {total}")
+            labels = _labels(self.labels, value)
+            lines.append(f"{self.name}_sum{labels} {self.sums[value]}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def merge(*texts: str) -> str:
+    # renders of several processes as one scrape, the samples of a family
+    # together under its HELP and TYPE lines
+    headers: dict[str, list[str]] = {}
+    samples: dict[str, list[str]] = {}
+    for text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                name = line.split()[2]
+                if len(headers.setdefault(name, [])) < 2:
+                    headers[name].append(line)
+                samples.setdefault(name, [])
+            elif line != "":
+                samples[name].append(line)
+    lines = []
+    for name, header in headers.items():
+        lines.extend(header)
+        lines.extend(samples[name])
+    return "\n".join(lines) + "\n"
+
+
+SECONDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05)
+SECONDS += (0.1, 0.25, 0.5, 1.0, 2.5)
+BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+STAGE_SECONDS = Histogram(
+    "roastcraft_stage_seconds",
+    "time spent per acquisition stage",
+    SECONDS,
+    ("roaster", "stage"),
+)
+TICK_LATENESS_SECONDS = Histogram(
+    "roastcraft_tick_lateness_seconds",
+    "how late a tick started against its deadline",
+    SECONDS,
+    ("ticker",),
+)
+LOOP_LAG_SECONDS = Histogram(
+    "roastcraft_loop_lag_seconds",
+    "how late the event loop woke a sleeping task, what any handler waits",
+    SECONDS,
+    ("loop",),
+)
+HANDLER_SECONDS = Histogram(
+    "roastcraft_handler_seconds",
+    "socket.io event handler latency, from call to return",
+    SECONDS,
+    ("event",),
+)
+SLOW_HANDLERS = Counter(
+    "roastcraft_slow_handlers_total",
+    "handler calls and loop stalls over processing.max_handler_latency",
+    ("event",),
+)
+MODBUS_ERRORS = Counter(
+    "roastcraft_modbus_errors_total", "failed modbus reads by kind", ("port", "kind")
+)
+PAYLOAD_BYTES = Histogram(
+    "roastcraft_payload_bytes", "encoded socket.io payload per emit", BYTES, ("event",)
+)
+CLIENTS = Gauge("roastcraft_clients", "connected socket.io clients", ("roaster",))
+
+
+class PayloadJson:
+    # json module for socket.io that records the size of every encoded emit,
+    # a broadcast is encoded once whatever the number of clients
+    @staticmethod
+    def dumps(data, **kwargs) -> str:
+        encoded = json.dumps(data, **kwargs)
+        if isinstance(data, list) and (len(data) > 0) and isinstance(data[0], str):
+            PAYLOAD_BYTES.observe(len(encoded), data[0])
+        return encoded
+
+    @staticmethod
+    def loads(data, **kwargs):
+        return json.loads(data, **kwargs)
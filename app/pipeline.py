@@ -0,0 +1,127 @@
+import time
+
+from app.calculate import RoastEventDetector, calculate_phases
+from app.classes import Channel, RoastEventId, RoastSession
+from app.journal import Journal
+
+
+def new_session(settings: dict) -> RoastSession:
+    session = RoastSession()
+    for ch in settings["channels"]:
+        c = Channel(
+            id=ch["id"],
+            color=ch["color"],
+            ror_estimator=ch["ror"]["estimator"],
+            ror_window=ch["ror"]["window"],
+        )
+        session.channels.append(c)
+        if ch["id"] == "BT":
+            session.bt_channel = c
+    return session
+
+
+class SampleWindow:
+    # device reads between two processing ticks. the device can be read
+    # faster than the session takes samples, the reads of a tick become one
+    # sample, their mean, with the min and max next to it
+    def __init__(self):
+        self.count: int = 0
+        self.time: float = 0.0  # sum of the read times
+        self.sum: dict[str, float] = {}
+        self.min: dict[str, float] = {}
+        self.max: dict[str, float] = {}
+
+    def add(self, result: dict, now: float):
+        self.count += 1
+        self.time += now
+        for id, value in result.items():
+            if id in self.sum:
+                self.sum[id] += value
+                self.min[id] = min(self.min[id], value)
+                self.max[id] = max(self.max[id], value)
+            else:
+                self.sum[id] = value
+                self.min[id] = value
+                self.max[id] = value
+
+    def aggregate(self) -> tuple[dict, float, dict] | None:
+        # (mean of each channel, mean read time, (min, max) of each channel),
+        # None when there was no read
+        if self.count == 0:
+            return None
+        n = self.count
+        result = {id: total / n for id, total in self.sum.items()}
+        spread = {id: (self.min[id], self.max[id]) for id in self.sum}
+        return result, self.time / n, spread
+
+
+def process(
+    session: RoastSession,
+    detector: RoastEventDetector,
+    result: dict,
+    now: float,
+    recording: bool,
+    journal: Journal | None = None,
+    timings: dict[str, float] | None = None,
+    spread: dict[str, tuple[float, float]] | None = None,
+) -> list[RoastEventId]:
+    # one device sample through ror, filters, event detection and phases,
+    # shared by the live processing tick and headless replays.
+    # now is the sample time on the session's monotonic clock, timings when
+    # given receives the seconds spent per stage. spread is the (min, max) of
+    # the reads averaged into the sample, by channel
+    lap = [time.perf_counter()]
+    elapsed = now - session.start_clock
+    timestamp = session.start_time.timestamp() + elapsed
+    for c in session.channels:
+        c.current_data = result[c.id]
+        if spread is None:
+            c.current_min = c.current_max = result[c.id]
+        else:
+            c.current_min, c.current_max = spread[c.id]
+
+        # calculate ror, per minute
+        c.current_ror = c.ror_estimator.push(now, result[c.id])
+    lap.append(time.perf_counter())
+
+    stages = ["ror"]
+    detected = []
+    if recording:
+        session.timer = elapsed - session.time_offset
+
+        for k, c in enumerate(session.channels):
+            c.append(timestamp, elapsed, result[c.id], c.current_ror)
+            if journal is not None:
+                journal.sample(k, elapsed, result[c.id], c.current_ror)
+        session.version += 1
+        lap.append(time.perf_counter())
+
+        bt = session.bt_channel
+        detected = detector.push(bt.current_data, bt.current_ror, session.roast_events)
+        if RoastEventId.C in detected:
+            session.time_offset = float(
+                bt.data.time[session.roast_events[RoastEventId.C]]
+            )
+            session.timer = elapsed - session.time_offset
+        lap.append(time.perf_counter())
+
+        if journal is not None:
+            for event_id in detected:
+                journal.event(event_id, session.roast_events[event_id])
+            journal.flush()
+        lap.append(time.perf_counter())
+        stages += ["append", "events", "journal"]
+
+    session.phases = calculate_phases(
+        session.timer,
+        session.bt_channel.current_data,
+        session.roast_events,
+        session,
+    )
+    lap.append(time.perf_counter())
+    stages.append("phases")
+
+    if timings is not None:
+        for k, stage in enumerate(stages):
+            timings[stage] = lap[k + 1] - lap[k]
+    return detected
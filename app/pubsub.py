@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import os
+import pickle
+import struct
+import uuid
+
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+# local pub/sub between the acquisition process and the web workers, over a
+# unix socket. a message is a pickled dict with a 4 byte length prefix, like
+# the messages socket.io's own pub/sub managers put on redis
+#
+# the acquisition process runs a Broker: every emit it makes is published to
+# all workers, whose BrokerManager hands it to their socket.io clients. the
+# workers send commands (button presses, subscriptions) back over the same
+# connection and get the result as a reply
+
+logger = logging.getLogger("uvicorn")
+
+HEADER = struct.Struct("<I")
+# a worker that has this much unsent is not reading, it is dropped and its
+# clients reconnect, a slow worker never holds up a tick
+MAX_BUFFERED = 16 * 1024 * 1024
+
+
+def encode(message: dict) -> bytes:
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(data)) + data
+
+
+async def receive(reader: asyncio.StreamReader) -> dict:
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return pickle.loads(await reader.readexactly(length))
+
+
+class Broker:
+    # fans every published message out to every connected worker, and runs
+    # the commands they send on target (a module or object of coroutines)
+    def __init__(self, path: str, target, commands: tuple[str, ...]):
+        self.path: str = path
+        self.target = target
+        self.commands: tuple[str, ...] = commands
+        self.host_id: str = uuid.uuid4().hex
+        self.writers: set[asyncio.StreamWriter] = set()
+        self.server: asyncio.AbstractServer = None
+
+    async def start(self):
+        directory = os.path.dirname(self.path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left over by a process that died
+        self.server = await asyncio.start_unix_server(self._serve, self.path)
+        logger.info("acquisition listening on %s", self.path)
+
+    async def close(self):
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+
+    async def emit(self, event: str, data=None, to: str | None = None):
+        # same call as socket.io's AsyncServer.emit, for the rooms of every worker
+        self.publish(
+            {
+                "method": "emit",
+                "event": event,
+                "data": data,
+                "namespace": "/",
+                "room": to,
+                "skip_sid": None,
+                "callback": None,
+                "host_id": self.host_id,
+            }
+        )
+
+    def publish(self, message: dict, sender: asyncio.StreamWriter | None = None):
+        # encoded once, whatever the number of workers, never waits on them
+        frame = encode(message)
+        for writer in list(self.writers):
+            if writer is sender:
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+                logger.warning("dropping a worker that stopped reading")
+                self.writers.discard(writer)
+                writer.close()
+                continue
+            writer.write(frame)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writers.add(writer)
+        subscribed = []  # subscribe() arguments of this worker's clients
+        try:
+            while True:
+                message = await receive(reader)
+                if message["method"] == "call":
+                    asyncio.get_running_loop().create_task(
+                        self._call(writer, message, subscribed)
+                    )
+                else:
+                    self.publish(message, sender=writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+            # the worker went away with its clients
+            if self.server.is_serving():
+                for args in subscribed:
+                    await self.target.unsubscribe(*args)
+
+    async def _call(
+        self, writer: asyncio.StreamWriter, message: dict, subscribed: list
+    ):
+        name = message["name"]
+        args = tuple(message["args"])
+        reply = {"method": "reply", "id": message["id"]}
+        try:
+            if name not in self.commands:
+                raise AttributeError(f"no command {name}")
+            if name == "subscribe":
+                subscribed.append(args)
+            elif name == "unsubscribe":
+                if args not in subscribed:
+                    # subscribed before this connection, that is undone already
+                    args = None
+                else:
+                    subscribed.remove(args)
+            reply["result"] = (
+                None if args is None else await getattr(self.target, name)(*args)
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.exception("command %s failed", name)
+            reply["error"] = f"{type(e).__name__}: {e}"
+        if not writer.is_closing():
+            writer.write(encode(reply))
+
+
+class BrokerManager(AsyncPubSubManager):
+    # socket.io client manager of a web worker: emits published by the
+    # acquisition process reach this worker's clients, and call() runs a
+    # command over there
+    name = "roastcraft"
+
+    def __init__(self, path: str, logger=None):  # pylint: disable=redefined-outer-name
+        super().__init__(channel="roastcraft", logger=logger)
+        self.path: str = path
+        self.writer: asyncio.StreamWriter | None = None
+        self.lock: asyncio.Lock | None = None
+        self.messages: asyncio.Queue | None = None
+        self.calls: dict[int, asyncio.Future] = {}
+        self.next_call: int = 0
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        # one connection, opened on first use and again after it drops
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+            self.messages = asyncio.Queue()
+        async with self.lock:
+            if self.writer is None:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+                asyncio.get_running_loop().create_task(self._read(reader))
+        return self.writer
+
+    async def _read(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                message = await receive(reader)
+                if message["method"] != "reply":
+                    await self.messages.put(message)
+                    continue
+                future = self.calls.pop(message["id"], None)
+                if (future is None) or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message["result"])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            logger.warning("lost the acquisition process")
+            self.writer = None
+            for future in self.calls.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("no acquisition process"))
+            self.calls.clear()
+            # the acquisition process forgot their subscriptions, they
+            # reconnect and subscribe again
+            if self.server is not None:
+                for sid, _ in list(self.get_participants("/", None)):
+                    await self.server.disconnect(sid, ignore_queue=True)
+
+    async def _publish(self, data):
+        writer = await self._connect()
+        writer.write(encode(data))
+
+    async def _listen(self):
+        while True:
+            if self.writer is None:
+                try:
+                    await self._connect()
+                except OSError:
+                    await asyncio.sleep(1)
+                    continue
+            yield await self.messages.get()
+
+    async def call(self, name: str, *args):
+        writer = await self._connect()
+        self.next_call += 1
+        future = asyncio.get_running_loop().create_future()
+        self.calls[self.next_call] = future
+        writer.write(
+            encode({"method": "call", "id": self.next_call, "name": name, "args": args})
+        )
+        return await future
+
+
+class Remote:
+    # the acquisition commands of a web worker, run in the acquisition
+    # process: store.acquisition.charge(...) is the same call either way
+    def __init__(self, manager: BrokerManager):
+        self.manager: BrokerManager = manager
+
+    def __getattr__(self, name: str):
+        async def call(*args):
+            return await self.manager.call(name, *args)
+
+        return call
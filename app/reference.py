@@ -0,0 +1,157 @@
+import os
+from collections import OrderedDict
+
+import numpy
+
+from app.alog import load_alog
+from app.classes import Channel
+from app.library import RoastLibrary
+from app.ror import RorEstimator
+
+# a past roast shown behind the live one, from the library or an .alog. it is
+# resampled once to a grid of roast time (seconds from CHARGE) up to DROP, so
+# following the live roast is an index and one interpolation per tick
+
+
+class ReferenceProfile:
+    def __init__(
+        self,
+        name: str,
+        time: numpy.ndarray,
+        bt: numpy.ndarray,
+        ror: numpy.ndarray,
+        smoothed: numpy.ndarray,
+        step: float,
+    ):
+        # time is roast time of the samples. ror is the estimator's, what the
+        # live current_ror is compared with, smoothed the curve that is drawn
+        self.name: str = name
+        self.step: float = step
+        self.time: numpy.ndarray = numpy.arange(0.0, time[-1] + step / 2, step)
+        self.bt: numpy.ndarray = numpy.interp(self.time, time, bt)
+        self.ror: numpy.ndarray = numpy.interp(self.time, time, ror)
+        self.smoothed: numpy.ndarray = numpy.interp(self.time, time, smoothed)
+        self._payload: dict | None = None
+
+    def at(self, time: float) -> tuple[float, float] | None:
+        # bt and ror at a roast time, None outside the profile
+        x = time / self.step
+        k = int(x)
+        if (x < 0) | (k >= len(self.time) - 1):
+            return None
+        f = x - k
+        bt = self.bt[k] + f * (self.bt[k + 1] - self.bt[k])
+        ror = self.ror[k] + f * (self.ror[k + 1] - self.ror[k])
+        return float(bt), float(ror)
+
+    def deviation(self, time: float, bt: float, ror: float) -> dict:
+        # live minus reference
+        reference = self.at(time)
+        if reference is None:
+            return {"bt": None, "ror": None}
+        return {"bt": bt - reference[0], "ror": ror - reference[1]}
+
+    def payload(self) -> dict:
+        # what a client draws, the grid values. built once, every snapshot
+        # carries it
+        if self._payload is None:
+            self._payload = {
+                "name": self.name,
+                "step": self.step,
+                "bt": self.bt.round(2).tolist(),
+                "ror": self.smoothed.round(2).tolist(),
+            }
+        return self._payload
+
+
+def _profile(
+    name: str,
+    time: numpy.ndarray,
+    bt: numpy.ndarray,
+    ror: numpy.ndarray,
+    charge: int,
+    drop: int,
+    step: float,
+) -> ReferenceProfile:
+    # drawn smoothed like the live curve, through the channel's hampel and
+    # hanning
+    channel = Channel("BT", "")
+    channel.extend(time, time, bt, ror)
+    smoothed = channel.ror_smoothed.value
+    if len(smoothed) < len(bt):
+        smoothed = channel.ror_filtered.value
+    roast = slice(charge, drop + 1)
+    return ReferenceProfile(
+        name,
+        time[roast] - time[charge],
+        bt[roast],
+        ror[roast],
+        smoothed[roast],
+        step,
+    )
+
+
+def from_alog(path: str, settings: dict) -> ReferenceProfile:
+    log = load_alog(path)
+    events = log.events()
+    if "CHARGE" not in events:
+        raise ValueError(f"{os.path.basename(path)} has no CHARGE")
+    time = numpy.asarray(log.time, dtype=float)
+    bt = numpy.asarray(log.bt, dtype=float)
+
+    # the ror the live pipeline would have computed, on the recorded times
+    ch = next(c for c in settings["channels"] if c["id"] == "BT")
+    estimator = RorEstimator(ch["ror"]["estimator"], ch["ror"]["window"])
+    ror = numpy.array([estimator.push(t, v) for t, v in zip(time, bt)])
+
+    drop = events.get("DROP", len(bt) - 1)
+    return _profile(
+        os.path.basename(path),
+        time,
+        bt,
+        ror,
+        events["CHARGE"],
+        drop,
+        settings["reference"]["grid_step"],
+    )
+
+
+def from_library(library: RoastLibrary, roast_id: int, settings: dict):
+    # None when there is no such roast
+    roast = library.roast(roast_id)
+    if roast is None:
+        return None
+    events = roast["roast_events"]
+    if "C" not in events:
+        raise ValueError(f"roast {roast_id} has no CHARGE")
+    bt = library.curves(roast_id)["BT"]
+    drop = events.get("D", len(bt["time"]) - 1)
+    return _profile(
+        f"#{roast_id} {roast['bean']}".strip(),
+        bt["time"],
+        bt["value"],
+        bt["ror"],
+        events["C"],
+        drop,
+        settings["reference"]["grid_step"],
+    )
+
+
+class ReferenceCache:
+    # least recently used profiles by source, switching back to one of them
+    # does not read and resample it again
+    def __init__(self, size: int):
+        self.size: int = size
+        self.profiles: OrderedDict[tuple, ReferenceProfile] = OrderedDict()
+
+    def get(self, key: tuple) -> ReferenceProfile | None:
+        profile = self.profiles.get(key)
+        if profile is not None:
+            self.profiles.move_to_end(key)
+        return profile
+
+    def put(self, key: tuple, profile: ReferenceProfile):
+        self.profiles[key] = profile
+        self.profiles.move_to_end(key)
+        while len(self.profiles) > self.size:
+            self.profiles.popitem(last=False)
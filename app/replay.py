@@ -0,0 +1,119 @@
+# feed recorded roasts through the live processing pipeline on a virtual clock
+#
+# python -m app.replay util/24-08-04_0946_mozart.alog [--speed 10]
+import argparse
+import asyncio
+import json
+import logging
+import time
+import typing
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+
+from app.calculate import RoastEventDetector
+from app.classes import RoastEventId, RoastSession
+from app.device import ArtisanLog
+from app.library import roast_summary
+from app.pipeline import new_session, process
+
+logger = logging.getLogger("uvicorn")
+
+
+class VirtualClock:
+    # stands in for time.monotonic, moved forward by the replay
+    def __init__(self, now: float = 0.0):
+        self.now: float = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def replay(
+    path: str,
+    settings: dict,
+    speed: float = 0,
+    on_tick: (
+        typing.Callable[[RoastSession, list[RoastEventId]], typing.Awaitable] | None
+    ) = None,
+    run: typing.Callable[..., typing.Awaitable] | None = None,
+) -> RoastSession:
+    # speed: multiple of real time, 0 runs as fast as possible.
+    # on_tick is awaited after every sample, e.g. to broadcast the session.
+    # run(function, *args) is where process() runs, Roaster.run when the
+    # session is shown on a roaster, on the loop when it is None
+    device = ArtisanLog(path)
+    await device.connect()
+    log = device.log
+
+    clock = VirtualClock()
+    session = new_session(settings)
+    session.start_time = datetime.fromtimestamp(log.roastepoch)
+    session.start_clock = clock()
+    detector = RoastEventDetector(**settings["event_detection"])
+
+    # samples are taken at the recorded times, recording from the first one
+    started = time.monotonic()
+    while device.remaining > 0:
+        clock.now = session.start_clock + float(log.time[device.index])
+        result = await device.read()
+        if run is None:
+            detected = process(session, detector, result, clock(), True)
+        else:
+            detected = await run(process, session, detector, result, clock(), True)
+
+        if on_tick is not None:
+            await on_tick(session, detected)
+
+        if speed > 0:
+            due = started + (clock() - session.start_clock) / speed
+            await asyncio.sleep(max(0.0, due - time.monotonic()))
+        else:
+            # let the event loop serve others between samples
+            await asyncio.sleep(0)
+
+    return session
+
+
+def replay_result(session: RoastSession) -> dict:
+    return {
+        "samples": len(session.bt_channel.data),
+        "roast_events": jsonable_encoder(session.roast_events),
+        "phases": jsonable_encoder(session.phases),
+        **roast_summary(session),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay .alog files headless")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--settings", default="app/settings.json")
+    parser.add_argument(
+        "--speed", type=float, default=0, help="times real time, 0 is unthrottled"
+    )
+    parser.add_argument(
+        "--detector",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="override an event_detection setting",
+    )
+    args = parser.parse_args()
+    logger.setLevel(logging.ERROR)
+
+    with open(args.settings, "rb") as f:
+        settings = json.load(f)
+    for override in args.detector:
+        name, value = override.split("=", 1)
+        settings["event_detection"][name] = float(value)
+
+    for path in args.paths:
+        start = time.perf_counter()
+        session = asyncio.run(replay(path, settings, args.speed))
+        elapsed = time.perf_counter() - start
+        print(json.dumps({"path": path, "seconds": round(elapsed, 4)}))
+        print(json.dumps(replay_result(session)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+import asyncio
+import logging
+import os
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app.broadcast import SessionCursor
+from app.calculate import RoastEventDetector
+from app.classes import AppStatus, RoastEventId, RoastSession
+from app.device import ArtisanLog, Device, Kapok501
+from app.downsample import SessionView
+from app.journal import Journal, recover
+from app.library import RoastLibrary
+from app.pipeline import SampleWindow, new_session, process
+from app.reference import ReferenceProfile
+from app.scheduler import Deadline, Ticker
+from app.series import EncodedCache, info, series_range
+from app.wire import delta_frames, event_frames, snapshot_frames
+
+logger = logging.getLogger("uvicorn")
+
+
+def merge(base: dict, override: dict) -> dict:
+    # override's keys on base, nested dicts merged key by key
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) & isinstance(merged.get(key), dict):
+            value = merge(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+def roaster_settings(settings: dict, entry: dict) -> dict:
+    # an entry of settings["roasters"] overrides the top level settings,
+    # e.g. its own device, serial port or channels. only the keys it names,
+    # {"serial": {"port": ...}} keeps the timeout and retries
+    return merge({k: v for k, v in settings.items() if k != "roasters"}, entry)
+
+
+def make_device(settings: dict) -> Device:
+    if settings["device"] == "Kapok501":
+        serial = settings["serial"]
+        return Kapok501(
+            serial["port"], timeout=serial["timeout"], retries=serial["retries"]
+        )
+    return ArtisanLog(settings.get("alog", "util/24-08-04_0946_mozart.alog"))
+
+
+def plot_width(settings: dict, width: int) -> int:
+    # reported plot width to the width of a shared view, 0 for full
+    # resolution when the samples are no denser than the pixels
+    if width <= 0:
+        return 0  # not reported
+    downsampling = settings["downsampling"]
+    step = downsampling["width_step"]
+    width = max(step, width // step * step)
+    interval = settings["scheduler"]["process_interval"]
+    if width * interval >= downsampling["chart_seconds"]:
+        return 0
+    return width
+
+
+class Roaster:
+    # one roasting machine: its device, session and tickers. its clients are
+    # in the socket.io room named after the roaster id
+    #
+    # the session is only touched on the roaster's processing thread, see run(),
+    # so the event loop never waits on numeric work and never sees a session
+    # half way through a tick. what the loop reads of it, shown and points,
+    # the thread keeps as plain values it replaces whole
+    def __init__(self, settings: dict):
+        self.id: str = settings["id"]
+        self.name: str = settings.get("name", self.id)
+        self.settings: dict = settings
+        self.device: Device = make_device(settings)
+        logger.info("roaster %s: %s", self.id, settings["device"])
+
+        # clients per (wire, plot width), and the downsampled views they use
+        self.subscribers: dict[tuple[str, int], int] = {}
+        self.views: dict[int, SessionView] = {}
+        self.encoded: EncodedCache = None
+
+        self.reference: ReferenceProfile | None = None  # followed by every tick
+        self.session: RoastSession = None
+        self.cursor: SessionCursor = None
+        self.shown: int = -1  # BT index of the last point published
+        self.points: dict[str, int] = {}  # points per series, for the metrics
+        self.channel_ids: list[str] = [ch["id"] for ch in settings["channels"]]
+        self.event_detector: RoastEventDetector = None
+        self.detected: list[RoastEventId] = []  # since the last publish
+        self.reset()
+        # reads since the last processing tick, filled and taken on the loop
+        self.samples: SampleWindow = SampleWindow()
+
+        self.app_status: AppStatus = AppStatus.OFF
+        self.journal: Journal | None = None  # open while RECORDING
+
+        self.read_device_ticker: Ticker = None
+        self.update_timer_ticker: Ticker = None
+        self.read_device_task: asyncio.Task = None
+        self.update_timer_task: asyncio.Task = None
+        # session samples and emits, at their own rates on the device reads
+        self.process_deadline: Deadline = None
+        self.publish_deadline: Deadline = None
+        self.replay_task: asyncio.Task | None = None  # replay shown to the clients
+        # the roaster's own session while a replay's is shown, see show()
+        self.replaced: RoastSession | None = None
+
+        self.processing = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"{self.id}-processing"
+        )
+
+    @property
+    def journal_directory(self) -> str:
+        return os.path.join(self.settings["journal"]["directory"], self.id)
+
+    def reset(self):
+        self.use_session(new_session(self.settings))
+        self.event_detector = RoastEventDetector(**self.settings["event_detection"])
+        self.detected = []
+
+    def use_session(self, session: RoastSession):
+        self.session = session
+        self.cursor = SessionCursor()
+        self.views = {width: self.view(width) for width in self.views}
+        # ranges of the session api, nothing of the last session is asked for
+        self.encoded = EncodedCache(self.settings["api"]["cache_bytes"])
+        self.shown = -1
+        self.count()
+
+    def count(self):
+        session = self.session
+        series = session.channels + [session.gas_channel]
+        self.points = {s.id: len(s.data) for s in series}
+
+    def delta(self) -> dict:
+        # delta_frames of every subscription, the clients see BT up to shown
+        frames = delta_frames(self.session, self.cursor, self.subscriptions, self.views)
+        self.shown = self.cursor.sent.get("BT.data", 0) - 1
+        return frames
+
+    def view(self, width: int) -> SessionView:
+        downsampling = self.settings["downsampling"]
+        return SessionView(
+            self.session, width, downsampling["chart_seconds"], downsampling["window"]
+        )
+
+    @property
+    def subscriptions(self) -> list[tuple[str, int]]:
+        return list(self.subscribers)
+
+    async def run(self, function: typing.Callable, *args):
+        # function(*args) on the processing thread, in submission order
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.processing, function, *args)
+
+    # the methods below run on the processing thread, through run(). what they
+    # return is handed to the loop and shares nothing with the session
+
+    def subscribe(self, wire: str, width: int) -> dict:
+        # a client joined, returns its read_device payload
+        key = (wire, width)
+        self.subscribers[key] = self.subscribers.get(key, 0) + 1
+        if (width > 0) and (width not in self.views):
+            self.views[width] = self.view(width)
+        return self.snapshot([key])[key]
+
+    def unsubscribe(self, wire: str, width: int):
+        key = (wire, width)
+        self.subscribers[key] -= 1
+        if self.subscribers[key] == 0:
+            del self.subscribers[key]
+        if all(w != width for _, w in self.subscribers):
+            self.views.pop(width, None)
+
+    def tick(self, result: dict, now: float, recording: bool, spread: dict) -> dict:
+        # one session sample, the reads of a processing tick aggregated
+        session = self.session
+        timings = {}
+        detected = process(
+            session,
+            self.event_detector,
+            result,
+            now,
+            recording,
+            self.journal,
+            timings,
+            spread,
+        )
+        self.detected += detected
+
+        start = time.perf_counter()
+        bt = session.bt_channel
+        charged = RoastEventId.C in session.roast_events
+        if recording & charged & (self.reference is not None):
+            session.deviation = self.reference.deviation(
+                session.timer, bt.current_data, bt.current_ror
+            )
+        timings["reference"] = time.perf_counter() - start
+
+        if recording:
+            logger.info("roast_session timer : %s", session.timer)
+        logger.info(session.phases)
+        self.count()
+        return {"timings": timings}
+
+    def publish(self) -> dict:
+        # the samples taken since the last publish, as one delta per
+        # subscription, and the events detected in them
+        session = self.session
+        start = time.perf_counter()
+        frames = self.delta()
+        serialize = time.perf_counter() - start
+
+        detected, self.detected = self.detected, []
+        self.count()
+        return {
+            "detected": detected,
+            "time_offset": session.time_offset,
+            "roast_events": event_frames(session, self.subscriptions, self.views),
+            "frames": frames,
+            "timings": {"serialize": serialize},
+        }
+
+    def snapshot(self, subscriptions: list[tuple[str, int]] | None = None) -> dict:
+        if subscriptions is None:
+            subscriptions = self.subscriptions
+        frames = snapshot_frames(self.session, self.cursor, subscriptions, self.views)
+        reference = None if self.reference is None else self.reference.payload()
+        for frame in frames.values():
+            frame["reference"] = reference
+        return frames
+
+    def series(
+        self,
+        key: str,
+        start: int | None,
+        stop: int | None,
+        since: float | None,
+        until: float | None,
+        wire: str,
+        etags: tuple[str, ...],
+    ) -> dict | None:
+        recording = self.journal is not None
+        return series_range(
+            self.session,
+            self.encoded,
+            key,
+            start,
+            stop,
+            since,
+            until,
+            wire,
+            etags,
+            recording,
+        )
+
+    def show(self, session: RoastSession, detected: list[RoastEventId]) -> dict:
+        # a replay's sample, the first one swaps the replay's session in and
+        # keeps the roaster's own for end_replay()
+        subscriptions = self.subscriptions
+        if self.session is not session:
+            if self.replaced is None:
+                self.replaced = self.session
+            self.use_session(session)
+            return {
+                "snapshot": snapshot_frames(
+                    session, self.cursor, subscriptions, self.views
+                )
+            }
+
+        self.count()
+        return {
+            "detected": detected,
+            "time_offset": session.time_offset,
+            "timer": session.timer,
+            "roast_events": event_frames(session, subscriptions, self.views),
+            "frames": self.delta(),
+        }
+
+    def end_replay(self) -> dict | None:
+        # the roaster's own session back after a replay, with its timer and
+        # read_device payloads. None when no replay was shown
+        if self.replaced is None:
+            return None
+        self.use_session(self.replaced)
+        self.replaced = None
+        return {"timer": self.session.timer, "frames": self.snapshot()}
+
+    def session_info(self) -> dict:
+        return info(self.session)
+
+    def use_reference(self, reference: ReferenceProfile | None):
+        self.reference = reference
+        self.session.deviation = {"bt": None, "ror": None}
+
+    def mark(
+        self, event_id: RoastEventId, index: int | None = None, step: int = 0
+    ) -> dict:
+        # operator marked an event at a BT index, taken when the button was
+        # pressed, or moved an earlier mark by step points
+        session = self.session
+        if index is None:
+            index = session.roast_events[event_id] + step
+        logger.info("%s at BT index : %s", event_id.name, index)
+
+        session.roast_events[event_id] = index
+        if event_id == RoastEventId.C:
+            # roast time is counted from CHARGE, points keep their time
+            session.time_offset = float(session.bt_channel.data.time[index])
+        if self.journal is not None:
+            self.journal.event(event_id, index)
+            self.journal.flush(sync=True)
+
+        return {
+            "time_offset": session.time_offset,
+            "roast_events": event_frames(session, self.subscriptions, self.views),
+        }
+
+    def gas(self, value, now: float):
+        session = self.session
+        gas = session.gas_channel
+        gas.current_data = value
+        elapsed = now - session.start_clock
+        gas.data.append(session.start_time.timestamp() + elapsed, elapsed, value)
+        session.version += 1
+
+        if self.journal is not None:
+            self.journal.gas(elapsed, float(value))
+            self.journal.flush()
+        self.count()
+
+        logger.info("%s gas_channel : %s (%s points)", self.id, value, len(gas.data))
+
+    def start(self, now: float):
+        session = self.session
+        session.start_time = datetime.now()
+        session.start_clock = now
+        gas = session.gas_channel
+        gas.data.append(session.start_time.timestamp(), 0, gas.current_data)
+
+        self.journal = Journal.create(
+            self.journal_directory, session, self.settings["journal"]["fsync_interval"]
+        )
+        self.journal.gas(0, float(gas.current_data))
+        self.journal.flush(sync=True)
+        self.count()
+
+        logger.info(
+            "%s gas_channel : %s (%s points)", self.id, gas.current_data, len(gas.data)
+        )
+
+    def stop(self, library: RoastLibrary):
+        if self.journal is not None:
+            self.journal.finish()
+            self.journal = None
+            # the roast is finished, keep it before reset throws it away
+            library.archive(self.session, roaster=self.id)
+
+    def recover(self, path: str, now: float):
+        recover(path, self.session, self.event_detector, now)
+        self.journal = Journal(path, self.settings["journal"]["fsync_interval"])
+        self.count()
+
+    def timer(self, now: float) -> float:
+        session = self.session
+        session.timer = now - session.start_clock - session.time_offset
+        return session.timer
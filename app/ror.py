@@ -0,0 +1,133 @@
+import numpy
+
+# estimator -> degree of the local polynomial fitted over the window,
+# delta only looks at the first and last sample of the window
+ESTIMATORS = {"delta": 0, "least_squares": 1, "savitzky_golay": 2}
+
+
+def _fit_slopes(
+    x: numpy.ndarray, v: numpy.ndarray, mask: numpy.ndarray, degree: int
+) -> numpy.ndarray:
+    # least squares polynomial per row, x is time relative to the row's last
+    # sample, returns the derivative at x = 0 (nan where the fit is undefined)
+    powers = x[..., None] ** numpy.arange(degree + 1)
+    weighted = powers * mask[..., None]
+    a = numpy.einsum("nwp,nwq->npq", weighted, powers)
+    b = numpy.einsum("nwp,nw->np", weighted, v)
+
+    # a fit needs more distinct times than its degree, repeated timestamps
+    # leave the normal equations singular
+    distinct = mask[:, 0] + (
+        mask[:, 1:] & (~mask[:, :-1] | (x[:, 1:] != x[:, :-1]))
+    ).sum(axis=1)
+    valid = distinct > degree
+    a[~valid] = numpy.eye(degree + 1)
+    b[~valid] = 0
+
+    slopes = numpy.linalg.solve(a, b[..., None])[:, 1, 0]
+    slopes[~valid] = numpy.nan
+    return slopes
+
+
+def _delta(
+    time: numpy.ndarray, value: numpy.ndarray, first: numpy.ndarray
+) -> numpy.ndarray:
+    # per minute, from the first to the last sample of every window
+    elapsed = time - time[first]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return numpy.where(
+            elapsed > 0, (value - value[first]) * 60 / elapsed, numpy.nan
+        )
+
+
+def _carry_forward(ror: numpy.ndarray) -> numpy.ndarray:
+    # an undefined ror keeps the previous one, 0 before the first
+    defined = ~numpy.isnan(ror)
+    last = numpy.maximum.accumulate(numpy.where(defined, numpy.arange(len(ror)), -1))
+    return numpy.where(last >= 0, ror[numpy.maximum(last, 0)], 0.0)
+
+
+def batch_ror(
+    time: numpy.ndarray,
+    value: numpy.ndarray,
+    estimator: str = "delta",
+    window: float = 8.0,
+) -> numpy.ndarray:
+    # ror per minute of every sample in one pass, for replays and re-analysis,
+    # same result as pushing the samples through RorEstimator one by one
+    n = len(time)
+    if n == 0:
+        return numpy.zeros(0)
+
+    # first sample inside the window of every sample, see RorEstimator.push
+    spacing = numpy.diff(time, prepend=time[0])
+    first = numpy.searchsorted(time, time - window - spacing / 2, side="left")
+
+    degree = ESTIMATORS[estimator]
+    if degree == 0:
+        return _carry_forward(_delta(time, value, first))
+
+    width = int((numpy.arange(n) - first).max()) + 1
+    rows = numpy.arange(n)[:, None] - (width - 1) + numpy.arange(width)
+    mask = rows >= first[:, None]
+    rows = numpy.maximum(rows, 0)
+
+    x = time[rows] - time[:, None]
+    slopes = _fit_slopes(x, value[rows], mask, degree)
+    return _carry_forward(slopes * 60)
+
+
+class RorEstimator:
+    # incremental ror per minute over the samples of the last `window` seconds
+    #
+    # samples live in a sliding buffer that is compacted to the front when it
+    # runs full, so the window is always a contiguous view
+    def __init__(self, estimator: str = "delta", window: float = 8.0):
+        self.estimator: str = estimator
+        self.degree: int = ESTIMATORS[estimator]
+        self.window: float = window
+        self.ror: float = 0.0
+
+        self.start: int = 0
+        self.end: int = 0
+        self._time: numpy.ndarray = numpy.zeros(64)
+        self._value: numpy.ndarray = numpy.zeros(64)
+
+    def _compact(self):
+        live = self.end - self.start
+        capacity = len(self._time)
+        if live * 2 > capacity:
+            capacity *= 2
+        for name in ("_time", "_value"):
+            column = numpy.zeros(capacity)
+            column[:live] = getattr(self, name)[self.start : self.end]
+            setattr(self, name, column)
+        self.start = 0
+        self.end = live
+
+    def push(self, time: float, value: float) -> float:
+        if self.end == len(self._time):
+            self._compact()
+        spacing = time - self._time[self.end - 1] if self.end > self.start else 0.0
+        self._time[self.end] = time
+        self._value[self.end] = value
+        self.end += 1
+
+        # drop samples that left the window, with half a sample interval of
+        # margin: a read a little late still reaches back the whole window
+        while self._time[self.start] < time - self.window - spacing / 2:
+            self.start += 1
+
+        t = self._time[self.start : self.end]
+        v = self._value[self.start : self.end]
+
+        if self.degree == 0:
+            if t[-1] > t[0]:
+                self.ror = float((v[-1] - v[0]) * 60 / (t[-1] - t[0]))
+        else:
+            mask = numpy.ones((1, len(t)), dtype=bool)
+            x = (t - t[-1])[None, :]
+            slope = _fit_slopes(x, v[None, :], mask, self.degree)[0]
+            if not numpy.isnan(slope):
+                self.ror = float(slope * 60)
+        return self.ror
@@ -0,0 +1,66 @@
+import typing
+
+from fastapi import APIRouter, HTTPException, Query
+
+from app import store
+
+router = APIRouter(prefix="/library")
+
+# sqlite calls block, plain def routes run them in the threadpool
+
+
+@router.get("/roasts")
+def roasts(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    roaster: str | None = None,
+    bean: str | None = None,
+    since: float | None = None,  # epoch seconds
+    until: float | None = None,
+    min_dtr: float | None = None,
+    max_dtr: float | None = None,
+    sort: typing.Literal[
+        "start_time", "bean", "total_time", "dtr", "drop_temp"
+    ] = "start_time",
+    descending: bool = True,
+):
+    total, page = store.library.roasts(
+        offset, limit, roaster, bean, since, until, min_dtr, max_dtr, sort, descending
+    )
+    return {"total": total, "offset": offset, "limit": limit, "roasts": page}
+
+
+@router.get("/roasts/{roast_id}")
+def roast(roast_id: int):
+    result = store.library.roast(roast_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"no roast {roast_id}")
+    return result
+
+
+@router.get("/roasts/{roast_id}/curves")
+def curves(roast_id: int):
+    result = store.library.curves(roast_id)
+    if len(result) == 0:
+        raise HTTPException(status_code=404, detail=f"no roast {roast_id}")
+    return {
+        channel: {
+            name: None if column is None else column.tolist()
+            for name, column in columns.items()
+        }
+        for channel, columns in result.items()
+    }
+
+
+@router.put("/roasts/{roast_id}/bean")
+def set_bean(roast_id: int, bean: str):
+    if not store.library.set_bean(roast_id, bean):
+        raise HTTPException(status_code=404, detail=f"no roast {roast_id}")
+    return {"id": roast_id, "bean": bean}
+
+
+@router.delete("/roasts/{roast_id}")
+def delete(roast_id: int):
+    if not store.library.delete(roast_id):
+        raise HTTPException(status_code=404, detail=f"no roast {roast_id}")
+    return {"id": roast_id}
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app import metrics, store
+
+router = APIRouter(prefix="/metrics")
+
+
+@router.get("", response_class=PlainTextResponse)
+async def scrape():
+    # with acquisition.separate: this worker's metrics and the acquisition
+    # process', the roaster metrics are all over there
+    text = metrics.render()
+    if store.settings["acquisition"]["separate"]:
+        text = metrics.merge(text, await store.acquisition.scrape())
+    return text
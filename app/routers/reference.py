@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from app import store
+from app.routers.replay import alog_path, roaster_or_404
+
+router = APIRouter(prefix="/reference")
+
+
+async def follow(roaster: str | None, source: str | None, key=None) -> dict:
+    r = roaster_or_404(roaster)
+    result = await store.acquisition.set_reference(r["id"], source, key)
+    if "error" in result:
+        # e.g. a log without CHARGE, nothing to align to
+        raise HTTPException(status_code=422, detail=result["error"])
+    return {"roaster": r["id"], **result}
+
+
+@router.put("/library/{roast_id}")
+async def library_roast(roast_id: int, roaster: str | None = None):
+    # the clients of the roaster see the archived roast behind the live one
+    if await run_in_threadpool(store.library.roast, roast_id) is None:
+        raise HTTPException(status_code=404, detail=f"no roast {roast_id}")
+    return await follow(roaster, "library", roast_id)
+
+
+@router.put("/alog/{name}")
+async def alog(name: str, roaster: str | None = None):
+    # an .alog from the replay directory
+    return await follow(roaster, "alog", alog_path(name))
+
+
+@router.delete("")
+async def clear(roaster: str | None = None):
+    return await follow(roaster, None)
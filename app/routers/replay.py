@@ -0,0 +1,62 @@
+import asyncio
+import os
+
+from fastapi import APIRouter, HTTPException
+
+from app import store
+from app.replay import replay, replay_result
+from app.roaster import roaster_settings
+
+router = APIRouter(prefix="/replay")
+
+
+def alog_path(name: str) -> str:
+    # logs are only read from the configured replay directory
+    directory = os.path.realpath(store.settings["replay"]["directory"])
+    path = os.path.realpath(os.path.join(directory, name))
+    if (os.path.dirname(path) != directory) | (not os.path.isfile(path)):
+        raise HTTPException(status_code=404, detail=f"no log {name}")
+    return path
+
+
+def roaster_or_404(roaster_id: str | None) -> dict:
+    # settings of the roaster
+    entries = store.settings["roasters"]
+    if roaster_id is None:
+        return roaster_settings(store.settings, entries[0])
+    for entry in entries:
+        if entry["id"] == roaster_id:
+            return roaster_settings(store.settings, entry)
+    raise HTTPException(status_code=404, detail=f"no roaster {roaster_id}")
+
+
+@router.get("")
+async def logs():
+    directory = store.settings["replay"]["directory"]
+    return sorted(name for name in os.listdir(directory) if name.endswith(".alog"))
+
+
+@router.post("/{name}")
+async def run(
+    name: str, roaster: str | None = None, speed: float = 0, show: bool = False
+):
+    # headless: replay at once with the roaster's settings and return the
+    # result. show: play it to the roaster's clients at speed, in the background
+    path = alog_path(name)
+    r = roaster_or_404(roaster)
+
+    if not show:
+        # processed on a worker thread, off the loop serving the clients
+        session = await replay(path, r, run=asyncio.to_thread)
+        return replay_result(session)
+
+    if not await store.acquisition.show_replay(r["id"], path, speed):
+        raise HTTPException(status_code=409, detail="roaster is in use")
+    return {"name": name, "roaster": r["id"], "speed": speed}
+
+
+@router.delete("")
+async def stop(roaster: str | None = None):
+    r = roaster_or_404(roaster)
+    await store.acquisition.stop_replay(r["id"])
+    return {}
@@ -0,0 +1,49 @@
+import typing
+
+from fastapi import APIRouter, HTTPException, Request, Response
+
+from app import store
+from app.routers.replay import roaster_or_404
+from app.series import MEDIA_TYPES
+
+router = APIRouter(prefix="/session")
+
+# the live session of a roaster by range, instead of a whole read_device
+# snapshot. a client sends back the ETag it got in If-None-Match, an
+# unchanged range is a 304 without a body
+
+
+@router.get("/{roaster_id}")
+async def session(roaster_id: str):
+    r = roaster_or_404(roaster_id)
+    return await store.acquisition.session_info(r["id"])
+
+
+@router.get("/{roaster_id}/series/{channel}/{name}")
+async def series(
+    request: Request,
+    roaster_id: str,
+    channel: str,
+    name: str,
+    start: int | None = None,
+    stop: int | None = None,
+    since: float | None = None,  # seconds since start, < 0 back from the last
+    until: float | None = None,
+    wire: typing.Literal["json", "binary"] = "json",
+):
+    # e.g. /session/roaster1/series/BT/ror_smoothed?since=-60 is the last
+    # minute of the smoothed BT ror
+    r = roaster_or_404(roaster_id)
+    matches = request.headers.get("if-none-match", "")
+    etags = tuple(e.strip().removeprefix("W/") for e in matches.split(",") if e)
+    result = await store.acquisition.series(
+        r["id"], f"{channel}.{name}", start, stop, since, until, wire, etags
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"no series {channel}.{name}")
+
+    # revalidated every time, a session reset changes any range
+    headers = {"ETag": result["etag"], "Cache-Control": "no-cache"}
+    if result["body"] is None:
+        return Response(status_code=304, headers=headers)
+    return Response(result["body"], media_type=MEDIA_TYPES[wire], headers=headers)
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import math
+import time
+import typing
+from collections import deque
+
+from app.metrics import LOOP_LAG_SECONDS, SLOW_HANDLERS, TICK_LATENESS_SECONDS
+
+logger = logging.getLogger("uvicorn")
+
+
+class Ticker:
+    # calls function_to_call on fixed deadlines of a monotonic clock, so the
+    # period does not stretch by the time the call itself takes
+    #
+    # a call running past the next deadline is an overrun, missed deadlines are
+    # either skipped ("skip") or run back to back until caught up ("catch_up")
+    def __init__(
+        self,
+        interval: float,
+        function_to_call: typing.Callable,
+        missed_deadline: str = "skip",
+        clock: typing.Callable[[], float] = time.monotonic,
+        name: str | None = None,
+    ):
+        self.interval: float = interval
+        self.function_to_call: typing.Callable = function_to_call
+        self.missed_deadline: str = missed_deadline
+        self.clock: typing.Callable[[], float] = clock
+        self.name: str = function_to_call.__name__ if name is None else name
+
+        self.ticks: int = 0
+        self.overruns: int = 0
+        self.skipped: int = 0
+        self.lateness: deque[float] = deque(maxlen=100)  # seconds, recent ticks
+        self.max_lateness: float = 0.0
+        self.errors: int = 0
+
+    async def run(self):
+        deadline = self.clock()
+        while True:
+            lateness = self.clock() - deadline
+            self.lateness.append(lateness)
+            self.max_lateness = max(self.max_lateness, lateness)
+            TICK_LATENESS_SECONDS.observe(max(0.0, lateness), self.name)
+            self.ticks += 1
+
+            try:
+                await self.function_to_call()
+            except Exception:  # pylint: disable=broad-exception-caught
+                # a failing tick must not stop the ticks after it
+                self.errors += 1
+                logger.exception("%s failed", self.name)
+
+            deadline += self.interval
+            overrun = self.clock() - deadline
+            if overrun > 0:
+                self.overruns += 1
+                logger.warning(
+                    "%s overran its deadline by %.3f s",
+                    self.name,
+                    overrun,
+                )
+                if self.missed_deadline == "skip":
+                    missed = math.ceil(overrun / self.interval)
+                    deadline += missed * self.interval
+                    self.skipped += missed
+
+            await asyncio.sleep(max(0.0, deadline - self.clock()))
+
+
+class Deadline:
+    # a lower rate inside a Ticker's: due() is true once per interval of the
+    # times it is called with. slack is how early a call still counts, half
+    # the calling ticker's interval, so jitter of the calls does not move work
+    # from one call to the next
+    def __init__(self, interval: float, slack: float = 0.0):
+        self.interval: float = interval
+        self.slack: float = slack
+        self.next: float | None = None
+
+    def due(self, now: float) -> bool:
+        if self.next is None:
+            self.next = now
+        if now < self.next - self.slack:
+            return False
+        # deadlines missed on the way are skipped, like a "skip" Ticker
+        missed = math.floor((now + self.slack - self.next) / self.interval)
+        self.next += (missed + 1) * self.interval
+        return True
+
+
+class LoopMonitor:
+    # sleeps for interval and measures how late the loop wakes it up. that is
+    # how long anything blocking the loop holds back every other handler, e.g.
+    # a FIRST CRACK press, so it is checked against the max_latency budget
+    def __init__(
+        self,
+        interval: float,
+        max_latency: float,
+        clock: typing.Callable[[], float] = time.monotonic,
+        name: str = "web",
+    ):
+        self.interval: float = interval
+        self.max_latency: float = max_latency
+        self.clock: typing.Callable[[], float] = clock
+        self.name: str = name  # of the process whose loop it is
+        self.max_lag: float = 0.0
+
+    async def run(self):
+        while True:
+            start = self.clock()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self.clock() - start - self.interval)
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag, self.name)
+            if lag > self.max_latency:
+                SLOW_HANDLERS.inc(f"loop.{self.name}")
+                logger.warning("%s event loop blocked for %.3f s", self.name, lag)
@@ -0,0 +1,160 @@
+import json
+from collections import OrderedDict
+
+import numpy
+from fastapi.encoders import jsonable_encoder
+
+from app.broadcast import session_series
+from app.classes import DerivedSeries, RoastSession
+
+# a range of one session series, for the REST api (app/routers/session.py).
+# json is columnar like the library curves, {"start", "stop", "time",
+# "value"}. binary is little endian like the wire frames:
+#
+#   int32    start, count
+#   float32  count times then count values
+#
+# the ETag of a range still being written is the session version. a range
+# no new sample can change is settled, its ETag stays for the session and its
+# encoded body is kept for the next client asking for it. both name the wire,
+# a json body never revalidates a binary one
+MEDIA_TYPES = {
+    "json": "application/json",
+    "binary": "application/octet-stream",
+}
+
+
+def lookup(session: RoastSession, key: str):
+    # series by its session_series() key, e.g. "BT.ror_smoothed"
+    return dict(session_series(session)).get(key)
+
+
+def settled(session: RoastSession, key: str, series) -> int:
+    # points below this index are final. the filtered and smoothed ror is
+    # rewritten until the hampel and hanning windows right of a point are full
+    if not isinstance(series, DerivedSeries):
+        return len(series)
+    c = next(c for c in session.channels if key.startswith(f"{c.id}."))
+    lag = c.ror_filter.window_size + c.ror_smoother.window_len // 2
+    return max(0, len(series) - lag)
+
+
+def resolve(
+    series,
+    start: int | None,
+    stop: int | None,
+    since: float | None,
+    until: float | None,
+) -> tuple[int, int]:
+    # [start, stop) of an index range, negative counts from the end like a
+    # slice, narrowed to the points between since and until (seconds since
+    # start, negative counts back from the last point)
+    start, stop, _ = slice(start, stop).indices(len(series))
+    time = series.time
+    if len(time) > 0:
+        last = float(time[-1])
+        if since is not None:
+            since = since + last if since < 0 else since
+            start = max(start, int(numpy.searchsorted(time, since, side="left")))
+        if until is not None:
+            until = until + last if until < 0 else until
+            stop = min(stop, int(numpy.searchsorted(time, until, side="right")))
+    return start, max(start, stop)
+
+
+def encode(series, start: int, stop: int, wire: str) -> bytes:
+    time = series.time[start:stop]
+    value = series.value[start:stop]
+    if wire == "binary":
+        return b"".join(
+            (
+                numpy.array([start, stop - start], dtype="<i4").tobytes(),
+                time.astype("<f4").tobytes(),
+                value.astype("<f4").tobytes(),
+            )
+        )
+    body = {
+        "start": start,
+        "stop": stop,
+        "time": time.tolist(),
+        "value": value.tolist(),
+    }
+    return json.dumps(body).encode()
+
+
+def info(session: RoastSession) -> dict:
+    # what a client needs to ask for ranges
+    return {
+        "id": session.id,
+        "version": session.version,
+        "start_time": jsonable_encoder(session.start_time),
+        "time_offset": session.time_offset,
+        "timer": session.timer,
+        "roast_events": jsonable_encoder(session.roast_events),
+        "series": {key: len(series) for key, series in session_series(session)},
+    }
+
+
+class EncodedCache:
+    # encoded bodies of settled ranges, least recently used out past max_bytes
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.size: int = 0
+        self.bodies: OrderedDict[tuple, bytes] = OrderedDict()
+
+    def get(self, key: tuple) -> bytes | None:
+        body = self.bodies.get(key)
+        if body is not None:
+            self.bodies.move_to_end(key)
+        return body
+
+    def put(self, key: tuple, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        old = self.bodies.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.bodies[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self.bodies.popitem(last=False)
+            self.size -= len(evicted)
+
+
+def series_range(
+    session: RoastSession,
+    cache: EncodedCache,
+    key: str,
+    start: int | None,
+    stop: int | None,
+    since: float | None,
+    until: float | None,
+    wire: str,
+    etags: tuple[str, ...] = (),
+    recording: bool = False,
+) -> dict | None:
+    # {"etag", "body"}, body None when etags has the current one. None when
+    # there is no such series
+    series = lookup(session, key)
+    if series is None:
+        return None
+    start, stop = resolve(series, start, stop, since, until)
+
+    final = stop <= settled(session, key, series)
+    if final:
+        etag = f'"{session.id}.{key}.{start}-{stop}.{wire}"'
+    else:
+        etag = f'"{session.id}.{session.version}.{wire}"'
+    if (etag in etags) | ("*" in etags):
+        return {"etag": etag, "body": None}
+
+    # the growing tail of a recording is asked for again at every length,
+    # only ranges behind it are worth keeping
+    if (not final) | (recording & (stop == len(series))):
+        return {"etag": etag, "body": encode(series, start, stop, wire)}
+    cache_key = (session.id, key, start, stop, wire)
+    body = cache.get(cache_key)
+    if body is None:
+        body = encode(series, start, stop, wire)
+        cache.put(cache_key, body)
+    return {"etag": etag, "body": body}
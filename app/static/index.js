@@ -44,21 +44,126 @@ const yScaleGas = d3
 .range([height - marginBottom, height - marginBottom - 160]);
 
 
+// binary frames of app/wire.py, decoded into the same objects as the json
+// payloads. ?wire=json in the page url asks the server for json instead
+const wire = new URLSearchParams(location.search).get('wire') ?? 'binary';
+const SERIES = ['data', 'ror', 'ror_filtered', 'ror_smoothed'];
+const EVENTS = ['C', 'TP', 'DE', 'FC', 'FCE', 'SC', 'SCE', 'D'];
+const PHASES = ['dry', 'mai', 'dev'];
+
+function nullable(v) {
+    return Number.isNaN(v) ? null : v;
+}
+
+function decode_frame(buffer) {
+    const ints = new Int32Array(buffer);
+    const floats = new Float32Array(buffer);
+    const [seq, n, m, e] = ints;
+    let k = 4;
+
+    const d = {
+        seq: seq,
+        time_offset: floats[k++],
+        timer: floats[k++],
+        gas_channel: { current_data: nullable(floats[k++]) },
+        channels: [],
+        roast_events: {},
+        phases: {}
+    };
+    for (let i = 0; i < n; i++) {
+        d.channels.push({
+            current_data: nullable(floats[k++]),
+            current_ror: nullable(floats[k++]),
+            current_min: nullable(floats[k++]),
+            current_max: nullable(floats[k++])
+        });
+    }
+    for (const p of PHASES) {
+        d.phases[p] = { time: floats[k++], percent: floats[k++], temp_rise: floats[k++] };
+    }
+    d.deviation = { bt: nullable(floats[k++]), ror: nullable(floats[k++]) };
+    for (let i = 0; i < e; i++, k += 2) {
+        d.roast_events[EVENTS[ints[k]]] = ints[k + 1];
+    }
+
+    // from, count of each series, then its times and values
+    let offset = k + 2 * m;
+    const patches = [];
+    for (let i = 0; i < m; i++, k += 2) {
+        const count = ints[k + 1];
+        const points = new Array(count);
+        for (let j = 0; j < count; j++) {
+            points[j] = { time: floats[offset + j], value: floats[offset + count + j] };
+        }
+        offset += 2 * count;
+        patches.push({ from: ints[k], points: points });
+    }
+    d.channels.forEach((c, i) => {
+        SERIES.forEach((name, j) => { c[name] = patches[i * SERIES.length + j]; });
+    });
+    d.gas_channel.data = patches[m - 1];
+    return d;
+}
+
+// binary snapshot: channel ids and colors next to a frame of every point
+function decode_snapshot(s) {
+    const d = decode_frame(s.frame);
+    return {
+        ...d,
+        start_time: s.start_time,
+        reference: s.reference,
+        channels: s.channels.map((c, i) => ({
+            ...c,
+            current_data: d.channels[i].current_data,
+            current_ror: d.channels[i].current_ror,
+            current_min: d.channels[i].current_min,
+            current_max: d.channels[i].current_max,
+            ...Object.fromEntries(SERIES.map((name) => [name, d.channels[i][name].points]))
+        })),
+        gas_channel: {
+            ...s.gas_channel,
+            current_data: d.gas_channel.current_data,
+            data: d.gas_channel.data.points
+        }
+    };
+}
+
+// point time is counted from start, roast time from CHARGE
+const timeOffset = ref(0);
+
 // Declare the line generator.
 const line = d3.line()
-    .x((p) => xScale(p.time))
+    .x((p) => xScale(p.time - timeOffset.value))
     .y((p) => yScale(p.value));
 
 const lineROR = d3.line()
-    .x((p) => xScale(p.time))
+    .x((p) => xScale(p.time - timeOffset.value))
     .y((p) => yScaleROR(p.value));
 
 const lineInlet = d3.line()
-    .x((p) => xScale(p.time))
+    .x((p) => xScale(p.time - timeOffset.value))
     .y((p) => yScaleInlet(p.value));
 
-const lineGas = d3.line()
+// reference profile points are in roast time already
+const lineReference = d3.line()
+    .x((p) => xScale(p.time))
+    .y((p) => yScale(p.value));
+
+const lineReferenceROR = d3.line()
     .x((p) => xScale(p.time))
+    .y((p) => yScaleROR(p.value));
+
+// grid values of app/reference.py to points, null when there is none
+function reference_profile(r) {
+    if (r == null) {
+        return null;
+    }
+    const points = (values) => values.map((v, k) => ({ time: k * r.step, value: v }));
+    return { name: r.name, bt: points(r.bt), ror: points(r.ror) };
+}
+
+const lineGas = d3.line()
+    .x((p) => xScale(p.time - timeOffset.value))
     .y((p) => yScaleGas(p.value))
     .curve(d3.curveStepAfter);
 
@@ -76,12 +181,16 @@ const app = createApp({
 
         let appStatus = ref(appstatus_init)
 
+        let reference = ref(null)
+
         let session = ref({
             channels: settings.channels.map((c) => ({
               id: c.id,
               color: c.color,
               current_data: 0,
               current_ror: 0,
+              current_min: 0,
+              current_max: 0,
               data: [],
               ror: [],
               ror_filtered: [],
@@ -94,6 +203,7 @@ const app = createApp({
                 mai:{time:0, percent:0, temp_rise:0},
                 dev:{time:0, percent:0, temp_rise:0},
             },
+            deviation: { bt: null, ror: null },
             gas_channel: {}
           });        
 
@@ -107,16 +217,47 @@ const app = createApp({
         // const socket = io("http://localhost:8000", {
         //   opts: { path: "/socket.io" },
         // });
-        const socket = io();
+        // the server puts this client in its roaster's room
+        // the server downsamples to the plot width this screen shows
+        const plot_width = Math.round(
+            Math.min(width, document.documentElement.clientWidth) - marginLeft - marginRight
+        );
+        // websocket only: with several web workers a polling request could
+        // land on a worker that does not know the session
+        const socket = io({
+            query: { roaster: roaster_id, wire: wire, width: plot_width },
+            transports: ["websocket"]
+        });
 
-        socket.on("read_device", (s) => {
-            console.log(s)
+        // the server drops its clients when it loses the acquisition process,
+        // they join again and get a new snapshot
+        socket.on("disconnect", (reason) => {
+            if (reason === "io server disconnect") {
+                setTimeout(() => socket.connect(), 1000);
+            }
+        });
 
-            session.value = s;
+        let seq = 0;
+        let resyncing = false;
+
+        // smoothed ror is only shown from CHARGE until DROP, by time as a
+        // downsampled series has its own indices
+        function roast_range(series) {
+            let bisect = d3.bisector((p) => p.time).left;
+            let start = bisect(series, timeOffset.value);
+            let stop = series.length;
+            let drop = session.value.channels[0].data[session.value.roast_events.D];
+            if (drop !== undefined) {
+                stop = bisect(series, drop.time);
+            }
+            return series.slice(start, Math.max(start, stop));
+        }
 
-            let bt=s.channels[0];
-            let et=s.channels[1];
-            let inlet=s.channels[2];
+        function update_labels() {
+            let bt=session.value.channels[0];
+            let et=session.value.channels[1];
+            let inlet=session.value.channels[2];
+            let bt_ror=roast_range(bt.ror_smoothed);
 
             // tool tip labels
             let labels=[]
@@ -124,29 +265,29 @@ const app = createApp({
             if(bt.data.length > 0) {
                 labels.push({
                     label: bt.data.at(-1).value.toFixed(1), 
-                    x: xScale(bt.data.at(-1).time)+2,
+                    x: xScale(bt.data.at(-1).time - timeOffset.value)+2,
                     y: yScale(bt.data.at(-1).value)
                 })   
             }
             if(et.data.length > 0) {
                 labels.push({
                     label: et.data.at(-1).value.toFixed(1), 
-                    x: xScale(et.data.at(-1).time)+2,
+                    x: xScale(et.data.at(-1).time - timeOffset.value)+2,
                     y: yScale(et.data.at(-1).value)
                 })   
             }
             if(inlet.data.length > 0) {
                 labels.push({
                     label: inlet.data.at(-1).value.toFixed(1), 
-                    x: xScale(inlet.data.at(-1).time)+2,
+                    x: xScale(inlet.data.at(-1).time - timeOffset.value)+2,
                     y: yScaleInlet(inlet.data.at(-1).value)
                 })   
             }
-            if(bt.ror_smoothed.length > 0) {
+            if(bt_ror.length > 0) {
                 labels.push({
-                    label: bt.ror_smoothed.at(-1).value.toFixed(1), 
-                    x: xScale(bt.ror_smoothed.at(-1).time)+2,
-                    y: yScaleROR(bt.ror_smoothed.at(-1).value)
+                    label: bt_ror.at(-1).value.toFixed(1), 
+                    x: xScale(bt_ror.at(-1).time - timeOffset.value)+2,
+                    y: yScaleROR(bt_ror.at(-1).value)
                 })
             }
 
@@ -161,7 +302,66 @@ const app = createApp({
             }
 
             toolTipLabels.value = labels
-            
+        }
+
+        // replace everything from patch.from onwards with patch.points
+        function merge(series, patch) {
+            series.splice(patch.from, series.length - patch.from, ...patch.points);
+        }
+
+        // full snapshot, sent on connect, on reset and when we ask for a resync
+        socket.on("read_device", (payload) => {
+            const s = (payload.frame === undefined) ? payload : decode_snapshot(payload);
+            console.log(s)
+
+            session.value = s;
+            reference.value = reference_profile(s.reference);
+            seq = s.seq;
+            resyncing = false;
+            timeOffset.value = s.time_offset;
+
+            update_labels();
+        });
+
+        socket.on("read_device_delta", (payload) => {
+            const d = (payload instanceof ArrayBuffer) ? decode_frame(payload) : payload;
+            if (d.seq != seq + 1) {
+                // missed a delta, ask for a full snapshot
+                if (!resyncing) {
+                    resyncing = true;
+                    socket.emit("resync", seq);
+                }
+                return;
+            }
+            seq = d.seq;
+
+            let s = session.value;
+            d.channels.forEach((dc, i) => {
+                let c = s.channels[i];
+                c.current_data = dc.current_data;
+                c.current_ror = dc.current_ror;
+                c.current_min = dc.current_min;
+                c.current_max = dc.current_max;
+                merge(c.data, dc.data);
+                merge(c.ror, dc.ror);
+                merge(c.ror_filtered, dc.ror_filtered);
+                merge(c.ror_smoothed, dc.ror_smoothed);
+            });
+
+            if (s.gas_channel.data == undefined) {
+                s.gas_channel.data = [];
+            }
+            s.gas_channel.current_data = d.gas_channel.current_data;
+            merge(s.gas_channel.data, d.gas_channel.data);
+
+            s.timer = d.timer;
+            s.time_offset = d.time_offset;
+            timeOffset.value = d.time_offset;
+            s.roast_events = d.roast_events;
+            s.phases = d.phases;
+            s.deviation = d.deviation;
+
+            update_labels();
         });
 
         socket.on('update_timer', 
@@ -184,6 +384,18 @@ const app = createApp({
             session.value.roast_events = roast_events
         });
 
+        // CHARGE moved, every point keeps its time
+        socket.on("time_offset", (offset) => {
+            session.value.time_offset = offset;
+            timeOffset.value = offset;
+            update_labels();
+        });
+
+        // the roaster follows another past roast, or none
+        socket.on("reference", (r) => {
+            reference.value = reference_profile(r);
+        });
+
         socket.on("app_status", (app_status) => {
             appStatus.value = app_status
         });
@@ -204,8 +416,13 @@ const app = createApp({
             lineROR,
             lineInlet,
             lineGas,
+            lineReference,
+            lineReferenceROR,
+            reference,
             timer_str,
             timer,
+            timeOffset,
+            roast_range,
             appStatus,
             session,
             gasBubble,
@@ -1,23 +1,31 @@
 # https://docs.python.org/3/faq/programming.html#how-do-i-share-global-variables-across-modules
 import asyncio
+import types
+import typing
 import socketio
 import pymodbus.client as ModbusClient
-from app.classes import RoastSession, AppStatus
-from app.device import Device
+from app.library import RoastLibrary
+from app.pubsub import Remote
+from app.reference import ReferenceCache
+from app.roaster import Roaster
 
 settings: dict
 
 client: ModbusClient.AsyncModbusSerialClient
 
-device: Device
+roasters: dict[str, Roaster]  # by roaster id, in settings order, where they run
 
-session: RoastSession
+references: ReferenceCache  # profiles recently followed, where the roasters run
 
-app_status: AppStatus
+# app.acquisition, or its commands run in the acquisition process
+acquisition: types.ModuleType | Remote
+
+clients: dict[str, tuple[str, str, int]]  # sid -> roaster id, wire, plot width
+
+library: RoastLibrary
 
 loop: asyncio.AbstractEventLoop
 
-read_device_task: asyncio.Task
-update_timer_task: asyncio.Task
+clock: typing.Callable[[], float]  # monotonic seconds
 
 socketio_server: socketio.AsyncServer
@@ -0,0 +1,154 @@
+import numpy
+import socketio
+from fastapi.encoders import jsonable_encoder
+
+from app.broadcast import (
+    SessionCursor,
+    delta_starts,
+    json_delta,
+    session_series,
+    session_snapshot,
+    view_events,
+    view_series,
+)
+from app.classes import RoastEventId, RoastSession
+from app.metrics import PAYLOAD_BYTES
+
+# live session updates go out either as json, for debugging, or as binary
+# frames. a client picks one with ?wire=json|binary, and with ?width=<px> a
+# downsampled view (app/downsample.py). it joins the room of that pair, every
+# payload below is keyed by (wire, width), width 0 is full resolution
+WIRES = ("binary", "json")
+
+# a binary frame is little endian and 4 byte aligned, so the browser reads it
+# through Int32Array / Float32Array views without copying:
+#
+#   int32    seq, channel count n, series count m, event count e
+#   float32  time_offset, timer, gas current_data
+#   float32  current_data, current_ror, current_min, current_max of each channel
+#   float32  time, percent, temp_rise of each of PHASES
+#   float32  bt, ror deviation from the reference profile
+#   int32    position in EVENTS, BT index of each roast event
+#   int32    from, count of each series
+#   float32  count times then count values of each series
+#
+# series are in session_series() order. the timestamp column is not sent,
+# time is seconds since start. None goes out as NaN
+EVENTS = list(RoastEventId)
+PHASES = ("dry", "mai", "dev")
+
+
+def room(roaster_id: str, wire: str, width: int = 0) -> str:
+    if width == 0:
+        return f"{roaster_id}/{wire}"
+    return f"{roaster_id}/{wire}/{width}"
+
+
+def _float(value) -> float:
+    return numpy.nan if value is None else value
+
+
+def binary_delta(
+    session: RoastSession, seq: int, starts: dict[str, int], view=None
+) -> bytes:
+    series = [(key, view_series(view, key, s)) for key, s in session_series(session)]
+    roast_events = view_events(view, session)
+
+    floats = [session.time_offset, session.timer]
+    floats.append(_float(session.gas_channel.current_data))
+    for c in session.channels:
+        floats += [_float(c.current_data), _float(c.current_ror)]
+        floats += [_float(c.current_min), _float(c.current_max)]
+    for name in PHASES:
+        phase = session.phases[name]
+        floats += [phase.time, phase.percent, phase.temp_rise]
+    floats += [_float(session.deviation["bt"]), _float(session.deviation["ror"])]
+
+    ints = []
+    for name, index in roast_events.items():
+        ints += [EVENTS.index(RoastEventId(name)), index]
+    columns = []
+    for key, s in series:
+        start = starts[key]
+        ints += [start, len(s) - start]
+        columns += [s.time[start:], s.value[start:]]
+
+    header = numpy.array(
+        [seq, len(session.channels), len(series), len(roast_events)],
+        dtype="<i4",
+    )
+    return b"".join(
+        (
+            header.tobytes(),
+            numpy.array(floats, dtype="<f4").tobytes(),
+            numpy.array(ints, dtype="<i4").tobytes(),
+            numpy.concatenate(columns).astype("<f4").tobytes(),
+        )
+    )
+
+
+def binary_snapshot(session: RoastSession, cursor: SessionCursor, view=None) -> dict:
+    # what a frame does not carry, and a frame with every series from 0
+    starts = {key: 0 for key, _ in session_series(session)}
+    return {
+        "start_time": jsonable_encoder(session.start_time),
+        "channels": [{"id": c.id, "color": c.color} for c in session.channels],
+        "gas_channel": {"id": session.gas_channel.id},
+        "frame": binary_delta(session, cursor.seq, starts, view),
+    }
+
+
+def delta_frames(
+    session: RoastSession,
+    cursor: SessionCursor,
+    subscriptions: list[tuple[str, int]],
+    views: dict,
+) -> dict:
+    # read_device_delta payloads. the cursor and the views move on even when
+    # no client is connected, so the next delta starts where this one ends
+    starts = {0: delta_starts(session, cursor)}
+    for width, view in views.items():
+        starts[width] = view.update(session, starts[0])
+
+    frames = {}
+    for wire, width in subscriptions:
+        encode = binary_delta if wire == "binary" else json_delta
+        frames[(wire, width)] = encode(
+            session, cursor.seq, starts[width], views.get(width)
+        )
+    return frames
+
+
+def snapshot_frames(
+    session: RoastSession,
+    cursor: SessionCursor,
+    subscriptions: list[tuple[str, int]],
+    views: dict,
+) -> dict:
+    # read_device payloads
+    frames = {}
+    for wire, width in subscriptions:
+        encode = binary_snapshot if wire == "binary" else session_snapshot
+        frames[(wire, width)] = encode(session, cursor, views.get(width))
+    return frames
+
+
+def event_frames(
+    session: RoastSession, subscriptions: list[tuple[str, int]], views: dict
+) -> dict:
+    # roast_events payloads, indices are into the BT data each client has
+    return {
+        (wire, width): view_events(views.get(width), session)
+        for wire, width in subscriptions
+    }
+
+
+async def emit_frames(
+    sio: socketio.AsyncServer, roaster_id: str, event: str, frames: dict
+):
+    # one payload per (wire, width), to the roaster's clients in that room
+    for (wire, width), frame in frames.items():
+        await sio.emit(event, frame, to=room(roaster_id, wire, width))
+        if isinstance(frame, bytes):
+            # sent as an attachment, PayloadJson only sees its placeholder
+            PAYLOAD_BYTES.observe(len(frame), f"{event}.{wire}")
@@ -0,0 +1,292 @@
+# per-tick cost of every processing stage, against roast length and channel count
+#
+# python -m benchmarks.bench                    compare with benchmarks/baseline.json
+# python -m benchmarks.bench --update-baseline  store this machine's numbers
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+
+import numpy
+import socketio
+
+from app.broadcast import (
+    SessionCursor,
+    delta_starts,
+    json_delta,
+    session_delta,
+    session_snapshot,
+)
+from app.calculate import RoastEventDetector, calculate_phases
+from app.classes import RoastEventId
+from app.filters import HampelFilter, HanningSmoother
+from app.pipeline import new_session
+from app.reference import ReferenceProfile
+from app.wire import binary_delta
+
+BASELINE = "benchmarks/baseline.json"
+
+MINUTES = (2, 5, 10, 20)
+CHANNELS = (3, 8)
+TICKS = 50  # timed ticks per configuration
+
+STAGES = (
+    "ror",
+    "append",  # Series append, hampel and hanning of every channel
+    "hampel",
+    "hanning",
+    "events",
+    "phases",
+    "reference",  # deviation from a reference profile
+    "delta",
+    "emit",  # socket.io packet encoding of the delta
+    "tick",  # all of the above, what read_device costs
+    "frame",  # binary encoding of the same delta
+    "emit_frame",
+    "snapshot",  # a client connecting
+)
+
+
+def curves(channels: int, seconds: float, interval: float, seed: int = 0) -> dict:
+    # BT, ET, INLET shaped like a real roast: preheat, CHARGE at 30 s, turning
+    # point near 1:30, slowing rise to drop. extra channels follow ET
+    rng = numpy.random.default_rng(seed)
+    t = numpy.arange(0, seconds, interval)
+    roast = numpy.maximum(t - 30, 0)
+
+    bt = numpy.where(
+        t < 30,
+        195 + t * 0.1,
+        198 * numpy.exp(-roast / 25)
+        + (1 - numpy.exp(-roast / 25)) * (85 + 140 * (1 - numpy.exp(-roast / 420))),
+    )
+    et = numpy.where(t < 30, 230.0, 230 - 40 * numpy.exp(-roast / 60) + roast * 0.02)
+    inlet = 280 + 10 * numpy.sin(t / 90)
+
+    result = {"BT": bt, "ET": et, "INLET": inlet}
+    for k in range(3, channels):
+        result[f"T{k + 1}"] = et + k
+    return {
+        id: (values + rng.normal(0, 0.15, len(t))).round(1)
+        for id, values in list(result.items())[:channels]
+    }
+
+
+def settings(ids: list[str]) -> dict:
+    return {
+        "channels": [
+            {"id": id, "color": "#000000", "ror": {"estimator": "delta", "window": 8}}
+            for id in ids
+        ],
+        "event_detection": {"dry_end": 150, "turning_point_drop": 50, "slope_ratio": 2},
+    }
+
+
+class Stopwatch:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {stage: [] for stage in STAGES}
+
+    def time(self, stage: str, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.samples[stage].append(time.perf_counter() - start)
+        return result
+
+    def medians(self) -> dict[str, float]:
+        # microseconds per tick
+        return {
+            stage: statistics.median(samples) * 1e6
+            for stage, samples in self.samples.items()
+            if len(samples) > 0
+        }
+
+
+def json_delta_of(session, cursor: SessionCursor) -> tuple[dict, dict]:
+    starts = delta_starts(session, cursor)
+    return starts, json_delta(session, cursor.seq, starts)
+
+
+def run(minutes: float, channels: int, interval: float) -> dict[str, float]:
+    # grows a session to minutes, then times TICKS more ticks stage by stage,
+    # the same work process() and read_device do
+    ticks = int(minutes * 60 / interval)
+    data = curves(channels, (ticks + TICKS) * interval, interval)
+    ids = list(data)
+    session = new_session(settings(ids))
+    session.start_clock = 0.0
+    detector = RoastEventDetector()
+    cursor = SessionCursor()
+    packet = socketio.packet.Packet
+    watch = Stopwatch()
+
+    # the same curve as its own reference profile
+    roast = numpy.arange(len(data["BT"])) * interval
+    slope = numpy.gradient(data["BT"], roast) * 60
+    profile = ReferenceProfile("bench", roast, data["BT"], slope, slope, 1.0)
+
+    hampel = HampelFilter(window_size=3, n_sigmas=2)
+    hanning = HanningSmoother(window_len=11)
+    bt = session.bt_channel
+
+    def ror(now: float, k: int):
+        for c in session.channels:
+            c.current_data = float(data[c.id][k])
+            c.current_ror = c.ror_estimator.push(now, c.current_data)
+
+    def append(now: float):
+        for c in session.channels:
+            c.append(now, now, c.current_data, c.current_ror)
+
+    def events():
+        detected = detector.push(bt.current_data, bt.current_ror, session.roast_events)
+        if RoastEventId.C in detected:
+            index = session.roast_events[RoastEventId.C]
+            session.time_offset = float(bt.data.time[index])
+
+    def phases():
+        session.phases = calculate_phases(
+            session.timer, bt.current_data, session.roast_events, session
+        )
+
+    for k in range(ticks + TICKS):
+        now = k * interval
+        session.timer = now - session.time_offset
+        timed = k >= ticks
+
+        if not timed:
+            ror(now, k)
+            append(now)
+            events()
+            phases()
+            session_delta(session, cursor)
+            if k == ticks - 1:
+                # warm, the timed updates recompute only the changed tail
+                hanning.update(bt.ror_filtered.value, 0)
+            continue
+
+        start = time.perf_counter()
+        watch.time("ror", ror, now, k)
+        watch.time("append", append, now)
+        watch.time("hampel", hampel.push, bt.current_ror)
+        watch.time("hanning", hanning.update, bt.ror_filtered.value, len(bt.ror) - 4)
+        watch.time("events", events)
+        watch.time("phases", phases)
+        watch.time(
+            "reference",
+            profile.deviation,
+            session.timer,
+            bt.current_data,
+            bt.current_ror,
+        )
+        starts, delta = watch.time("delta", json_delta_of, session, cursor)
+        watch.time(
+            "emit",
+            lambda: packet(
+                socketio.packet.EVENT, data=["read_device_delta", delta]
+            ).encode(),
+        )
+        # the standalone hampel and hanning calls are not part of a tick
+        watch.samples["tick"].append(
+            time.perf_counter()
+            - start
+            - watch.samples["hampel"][-1]
+            - watch.samples["hanning"][-1]
+        )
+        frame = watch.time("frame", binary_delta, session, cursor.seq, starts)
+        watch.time(
+            "emit_frame",
+            lambda: packet(
+                socketio.packet.EVENT, data=["read_device_delta", frame]
+            ).encode(),
+        )
+        if k % 10 == 0:
+            watch.time("snapshot", session_snapshot, session, cursor)
+
+    return watch.medians()
+
+
+def report(results: dict[str, dict[str, float]]):
+    # scaling curves, one table per channel count, microseconds per tick
+    for channels in CHANNELS:
+        print(f"\n{channels} channels, us per tick")
+        print(f"{'stage':<10}" + "".join(f"{m:>9} min" for m in MINUTES))
+        for stage in STAGES:
+            row = [results[f"{m}min_{channels}ch"][stage] for m in MINUTES]
+            print(f"{stage:<10}" + "".join(f"{v:>13.1f}" for v in row))
+
+
+def compare(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    tolerance: float,
+    floor: float,
+) -> list[str]:
+    # a stage regresses when it is tolerance times slower than the baseline,
+    # and slower by more than floor microseconds (noise on tiny stages). a
+    # stage without a baseline fails too, it could never regress otherwise
+    regressions = []
+    for key, stages in results.items():
+        for stage, value in stages.items():
+            reference = baseline.get(key, {}).get(stage)
+            if reference is None:
+                regressions.append(f"{key} {stage}: {value:.1f} us, no baseline")
+                continue
+            if (value > reference * tolerance) & (value - reference > floor):
+                regressions.append(
+                    f"{key} {stage}: {value:.1f} us, baseline {reference:.1f} us"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-stage tick benchmarks")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds")
+    parser.add_argument("--tolerance", type=float, default=2.0)
+    parser.add_argument("--floor", type=float, default=20.0, help="microseconds")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+    logging.getLogger("uvicorn").setLevel(logging.ERROR)
+
+    results = {
+        f"{m}min_{ch}ch": run(m, ch, args.interval) for ch in CHANNELS for m in MINUTES
+    }
+    report(results)
+
+    # per added minute of roast, from the shortest to the longest session
+    span = MINUTES[-1] - MINUTES[0]
+    for channels in CHANNELS:
+        first = results[f"{MINUTES[0]}min_{channels}ch"]["tick"]
+        last = results[f"{MINUTES[-1]}min_{channels}ch"]["tick"]
+        growth = (last - first) / span
+        print(f"\ntick growth at {channels} channels: {growth:.2f} us per minute")
+
+    if args.update_baseline:
+        with open(BASELINE, "w", encoding="utf-8") as f:
+            json.dump(
+                {k: {s: round(v, 1) for s, v in r.items()} for k, r in results.items()},
+                f,
+                indent=2,
+            )
+            f.write("\n")
+        print(f"\nbaseline written to {BASELINE}")
+        return
+
+    try:
+        with open(BASELINE, "rb") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"\nno {BASELINE}, run with --update-baseline first")
+        return
+
+    regressions = compare(results, baseline, args.tolerance, args.floor)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if len(regressions) > 0:
+        sys.exit(1)
+    print("\nno stage over baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import numpy
+import pytest
+
+from app.calculate import hampel_filter_forloop
+from app.filters import HampelFilter, HanningSmoother
+
+
+def streamed(series: numpy.ndarray, window_size: int, n_sigmas: float):
+    # HampelFilter.push output laid over the input, like the for loop returns it
+    hampel = HampelFilter(window_size, n_sigmas)
+    filtered = series.copy()
+    outliers = []
+    for value in series.tolist():
+        result = hampel.push(value)
+        if result is not None:
+            i, value = result
+            if value != series[i]:
+                outliers.append(i)
+            filtered[i] = value
+    return filtered, outliers
+
+
+def series_with_outliers(rng: numpy.random.Generator, n: int, ties: bool):
+    # a noisy ramp with spikes, rounded to whole degrees for ties
+    series = numpy.cumsum(rng.normal(0.5, 1.0, n))
+    spikes = rng.choice(n, size=n // 10, replace=False)
+    series[spikes] += rng.choice([-1, 1], size=len(spikes)) * rng.uniform(
+        5, 50, len(spikes)
+    )
+    if ties:
+        series = series.round()
+    return series
+
+
+@pytest.mark.parametrize("window_size", [1, 2, 3, 5, 8])
+@pytest.mark.parametrize("n_sigmas", [2, 3])
+@pytest.mark.parametrize("ties", [False, True])
+def test_push_matches_forloop(window_size, n_sigmas, ties):
+    rng = numpy.random.default_rng(window_size * 10 + n_sigmas)
+    for _ in range(30):
+        series = series_with_outliers(rng, int(rng.integers(1, 120)), ties)
+        expected, expected_outliers = hampel_filter_forloop(
+            series, window_size, n_sigmas
+        )
+        filtered, outliers = streamed(series, window_size, n_sigmas)
+        numpy.testing.assert_array_equal(filtered, expected)
+        assert outliers == expected_outliers
+
+
+def test_push_matches_forloop_constant():
+    # a flat run has MAD 0, any other value in it is an outlier
+    series = numpy.array([20.0] * 12 + [21.0] + [20.0] * 12)
+    for window_size in (1, 3, 5):
+        expected, _ = hampel_filter_forloop(series, window_size, 2)
+        filtered, _ = streamed(series, window_size, 2)
+        numpy.testing.assert_array_equal(filtered, expected)
+
+
+def test_push_finalizes_after_window():
+    # index i comes back with sample i + window_size, the first window_size
+    # samples are never filtered
+    hampel = HampelFilter(window_size=3)
+    results = [hampel.push(float(v)) for v in range(10)]
+    assert results[:6] == [None] * 6
+    assert [r[0] for r in results[6:]] == [3, 4, 5, 6]
+
+
+def smooth_forloop(x: numpy.ndarray, window_len: int) -> numpy.ndarray:
+    # the full reflected convolution the smoother replaces
+    # https://scipy-cookbook.readthedocs.io/items/SignalSmooth.html
+    s = numpy.r_[x[window_len - 1 : 0 : -1], x, x[-2 : -window_len - 1 : -1]]
+    w = numpy.hanning(window_len)
+    y = numpy.convolve(w / w.sum(), s, mode="valid")
+    return y[int(window_len / 2) - 1 : -int(window_len / 2)][: len(x)]
+
+
+def smoothed(smoother: HanningSmoother, x: numpy.ndarray, changed: int, y):
+    start, values = smoother.update(x, changed)
+    return numpy.r_[y[:start], values]
+
+
+@pytest.mark.parametrize("window_len", [3, 5, 11])
+def test_update_matches_full_convolution(window_len):
+    # grown one sample at a time from empty, an earlier sample rewritten now
+    # and then like the hampel filter does
+    rng = numpy.random.default_rng(window_len)
+    for _ in range(10):
+        x = numpy.zeros(0)
+        y = numpy.zeros(0)
+        smoother = HanningSmoother(window_len)
+        for _ in range(int(rng.integers(1, 80))):
+            x = numpy.r_[x, rng.normal(20, 5)]
+            changed = len(x) - 1
+            if (len(x) > 4) & (rng.random() < 0.3):
+                changed = len(x) - 4
+                x[changed] = rng.normal(20, 5)
+            y = smoothed(smoother, x, changed, y)
+            if len(x) < window_len:
+                assert len(y) == 0
+            else:
+                numpy.testing.assert_allclose(y, smooth_forloop(x, window_len))
+
+
+def test_update_after_reset():
+    # a new smoother on a grown series, and a series rewritten from the start,
+    # then appends again
+    rng = numpy.random.default_rng(0)
+    x = rng.normal(20, 5, 40)
+    smoother = HanningSmoother(11)
+    y = smoothed(smoother, x, 0, numpy.zeros(0))
+    numpy.testing.assert_allclose(y, smooth_forloop(x, 11))
+
+    x = rng.normal(20, 5, 40)
+    y = smoothed(smoother, x, 0, y)
+    for _ in range(20):
+        x = numpy.r_[x, rng.normal(20, 5)]
+        y = smoothed(smoother, x, len(x) - 1, y)
+        numpy.testing.assert_allclose(y, smooth_forloop(x, 11))
+
+    # shorter than the window again, nothing until it has grown back
+    x = x[:5]
+    y = smoothed(smoother, x, 0, y)
+    assert len(y) == 0
+    for _ in range(10):
+        x = numpy.r_[x, rng.normal(20, 5)]
+        y = smoothed(smoother, x, len(x) - 1, y)
+    numpy.testing.assert_allclose(y, smooth_forloop(x, 11))
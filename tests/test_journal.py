@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import numpy
+
+from app.calculate import RoastEventDetector
+from app.classes import RoastEventId
+from app.journal import RECORD, Journal, recover
+from app.pipeline import new_session
+
+SETTINGS = {
+    "channels": [
+        {"id": id, "color": "#000000", "ror": {"estimator": "delta", "window": 8}}
+        for id in ("BT", "ET")
+    ]
+}
+
+
+def write(journal: Journal, times: list[float]):
+    for t in times:
+        journal.sample(0, t, 100 + t, 1.0)
+        journal.sample(1, t, 200 + t, 2.0)
+    journal.flush(sync=True)
+
+
+def recovered(path: str):
+    session = new_session(SETTINGS)
+    recover(path, session, RoastEventDetector(), 0.0)
+    return session
+
+
+def test_recover_after_torn_record(tmp_path):
+    session = new_session(SETTINGS)
+    session.start_time = datetime(2024, 8, 4, 9, 46)
+    journal = Journal.create(str(tmp_path), session)
+    write(journal, [0.0, 2.0, 4.0])
+    journal.event(RoastEventId.C, 1)
+    journal.flush(sync=True)
+    # the crash: half of a sample record made it to disk
+    journal.file.write(RECORD.pack(1, 0, 0, 0, 6.0, 106.0, 1.0)[:13])
+    journal.file.close()
+
+    session = recovered(journal.path)
+    assert session.bt_channel.data.time.tolist() == [0.0, 2.0, 4.0]
+
+    # recording carries on in the same file, and recovers again
+    journal = Journal(journal.path)
+    write(journal, [6.0, 8.0])
+    journal.file.close()
+
+    session = recovered(journal.path)
+    bt, et = session.channels
+    numpy.testing.assert_array_equal(bt.data.time, [0.0, 2.0, 4.0, 6.0, 8.0])
+    numpy.testing.assert_array_equal(bt.data.value, [100, 102, 104, 106, 108])
+    numpy.testing.assert_array_equal(et.data.value, [200, 202, 204, 206, 208])
+    assert session.roast_events == {RoastEventId.C: 1}
@@ -0,0 +1,49 @@
+import numpy
+import pytest
+
+from app.ror import ESTIMATORS, RorEstimator, batch_ror
+
+
+def pushed(time: numpy.ndarray, value: numpy.ndarray, estimator: str, window: float):
+    ror = RorEstimator(estimator, window)
+    return numpy.array([ror.push(t, v) for t, v in zip(time.tolist(), value.tolist())])
+
+
+@pytest.mark.parametrize("estimator", list(ESTIMATORS))
+@pytest.mark.parametrize("window", [4.0, 8.0, 15.0])
+def test_batch_matches_push(estimator, window):
+    # jittered reads around 2 s, with a gap and repeated timestamps
+    rng = numpy.random.default_rng(len(estimator) * 100 + int(window))
+    for _ in range(20):
+        n = int(rng.integers(1, 150))
+        step = 2 + rng.uniform(-0.4, 0.4, n)
+        step[rng.integers(0, n)] = 9.0
+        step[rng.integers(0, n)] = 0.0
+        time = numpy.cumsum(step)
+        value = 150 + numpy.cumsum(rng.normal(0.2, 0.5, n))
+        numpy.testing.assert_allclose(
+            batch_ror(time, value, estimator, window),
+            pushed(time, value, estimator, window),
+            rtol=1e-9,
+            atol=1e-9,
+        )
+
+
+@pytest.mark.parametrize("estimator", list(ESTIMATORS))
+def test_window_margin_edge(estimator):
+    # the window reaches back window + half the last interval: a sample right
+    # on that edge is in, one just past it is out, in both modes
+    value = numpy.array([100.0, 103.0, 104.0, 107.0, 108.0, 111.0])
+    for first, inside in ((1.0, True), (0.999, False)):
+        # last interval 2 s, cutoff 10 - 8 - 1 = 1
+        time = numpy.array([first, 2.0, 4.0, 6.0, 8.0, 10.0])
+        batch = batch_ror(time, value, estimator, 8.0)
+        live = pushed(time, value, estimator, 8.0)
+        numpy.testing.assert_allclose(batch, live, rtol=1e-9, atol=1e-9)
+
+        ror = RorEstimator(estimator, 8.0)
+        for t, v in zip(time, value):
+            ror.push(t, v)
+        assert (ror.end - ror.start == 6) == inside
+    if estimator == "delta":
+        assert live[-1] == pytest.approx((111 - 103) * 60 / 8)
@@ -0,0 +1,35 @@
+import pytest
+
+from app.pipeline import new_session
+from app.series import EncodedCache, series_range
+
+SETTINGS = {
+    "channels": [
+        {"id": "BT", "color": "#000000", "ror": {"estimator": "delta", "window": 8}}
+    ]
+}
+
+
+@pytest.fixture
+def session():
+    session = new_session(SETTINGS)
+    for k in range(40):
+        session.bt_channel.append(k * 2.0, k * 2.0, 100.0 + k, 30.0)
+    return session
+
+
+def ranged(session, key: str, stop: int | None, wire: str, etags=()):
+    cache = EncodedCache(1 << 20)
+    return series_range(session, cache, key, 0, stop, None, None, wire, etags)
+
+
+@pytest.mark.parametrize("key, stop", [("BT.data", 10), ("BT.ror_smoothed", None)])
+def test_etag_names_the_wire(session, key, stop):
+    # settled and live ranges: a json ETag does not revalidate a binary body
+    json_etag = ranged(session, key, stop, "json")["etag"]
+    binary = ranged(session, key, stop, "binary", (json_etag,))
+    assert binary["etag"] != json_etag
+    assert binary["body"] is not None
+
+    again = ranged(session, key, stop, "binary", (binary["etag"],))
+    assert again["body"] is None
@@ -1,14 +1,13 @@
-import codecs
-import ast
-from typing import Any, Dict
+# print the curves of an artisan log, python -m util.open_alog <file.alog>
+import sys
 
-with codecs.open("23-11-05_1013.alog", "rb", encoding='utf-8') as alog:
+from app.alog import load_alog
 
-    result: Dict[str, Any] = ast.literal_eval(alog.read())
+log = load_alog(sys.argv[1] if len(sys.argv) > 1 else "util/24-08-04_0946_mozart.alog")
 
-    # print(result)
-    print(result['timex'])
-    print(result['temp1'])
-    print(result['temp2'])
-    print(result['extraname1'])
-    print(result['extratemp1'][0])
+print(log.time)
+print(log.et)
+print(log.bt)
+print(log.extraname)
+print(log.extratemp[0])
+print(log.events())